@@ -0,0 +1,286 @@
+#!/usr/bin/python
+
+## Measure how tony's graph and I/O paths scale, using generated jhbuild
+## modulesets and strata.
+##
+## For each size, chunks are spread over a number of dependency levels and
+## each chunk depends on about --density chunks from lower levels. The same
+## graph is written as one jhbuild moduleset, and as a stack of strata with one
+## stratum per group of levels (the lowest two are foundation.morph and
+## devel.morph, as load_stratum_with_deps expects). Each stage then runs in its
+## own process so that its peak memory can be measured. 'peak KiB' includes
+## the untimed setup the stage needs; 'stage KiB' is how far the stage itself
+## raised that peak. A stage that raises is reported as failed, and the
+## benchmark then exits non-zero.
+##
+## Results are written as JSON, and --compare shows the change from an
+## earlier results file.
+
+import argparse
+import json
+import multiprocessing
+import os
+import Queue
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import tony
+from tony_jhbuild import JhbuildModules
+from tony_stratum import StratumGraph
+
+STAGES = [
+    'jhbuild-parse',
+    'get-module-list',
+    'load-stratum-with-deps',
+    'sort-sources',
+    'add-build-depends-to-all',
+    'write-json',
+]
+
+def chunk_name (i):
+    return 'chunk-%05i' % i
+
+def generate_graph (size, density, depth, seed):
+    """
+    Returns list of (level, build-depends) for each chunk. Dependencies only
+    point to lower levels, so the graph is acyclic and 'depth' levels deep.
+    """
+    rng = random.Random (seed)
+    levels = [i * depth // size for i in range (size)]
+    first_in_level = {}
+    for i, level in enumerate (levels):
+        first_in_level.setdefault (level, i)
+
+    graph = []
+    for i in range (size):
+        lower = first_in_level[levels[i]]
+        count = min (lower, int (rng.expovariate (1.0 / density)) if density > 0 else 0)
+        graph.append ((levels[i], sorted (rng.sample (range (lower), count))))
+    return graph
+
+def write_moduleset (path, graph):
+    f = open (path, 'w')
+    f.write ('<?xml version="1.0"?>\n<moduleset>\n')
+    f.write ('  <repository type="git" name="git.gnome.org" default="yes"\n'
+             '              href="git://git.gnome.org/"/>\n')
+    for i, (level, deps) in enumerate (graph):
+        f.write ('  <autotools id="%s">\n    <branch/>\n' % chunk_name (i))
+        if deps:
+            f.write ('    <dependencies>\n')
+            for d in deps:
+                f.write ('      <dep package="%s"/>\n' % chunk_name (d))
+            f.write ('    </dependencies>\n')
+        f.write ('  </autotools>\n')
+
+    # Everything that nothing else depends on
+    depended_on = set (d for (level, deps) in graph for d in deps)
+    f.write ('  <metamodule id="meta-all">\n    <dependencies>\n')
+    for i in range (len (graph)):
+        if i not in depended_on:
+            f.write ('      <dep package="%s"/>\n' % chunk_name (i))
+    f.write ('    </dependencies>\n  </metamodule>\n</moduleset>\n')
+    f.close ()
+
+def stratum_filenames (count):
+    return ['foundation.morph', 'devel.morph'] + \
+           ['stratum-%i.morph' % i for i in range (2, count)]
+
+def write_strata (path, graph, depth, strata, seed):
+    """
+    Write the chunks as 'strata' strata, each build-depending on the one
+    below. Returns the filename of the top stratum.
+    """
+    rng = random.Random (seed)
+    filenames = stratum_filenames (strata)
+    stratum_of = [min (level * strata // max (depth, 1), strata - 1)
+                  for (level, deps) in graph]
+
+    for s, filename in enumerate (filenames):
+        members = [i for i in range (len (graph)) if stratum_of[i] == s]
+        # Shuffled, so sort_sources has some work to do
+        rng.shuffle (members)
+
+        chunks = []
+        for i in members:
+            chunks.append ({
+                'name': chunk_name (i),
+                'repo': 'upstream:%s' % chunk_name (i),
+                'ref': 'master',
+                'build-depends': [chunk_name (d) for d in graph[i][1]
+                                  if stratum_of[d] == s]
+            })
+
+        stratum = { 'name': filename[:-len ('.morph')], 'kind': 'stratum',
+                    'chunks': chunks }
+        if s > 0:
+            stratum['build-depends'] = [{ 'morph': filenames[s - 1][:-len ('.morph')],
+                                          'repo': 'baserock:morphs',
+                                          'ref': 'master' }]
+
+        f = open (os.path.join (path, filename), 'w')
+        json.dump (stratum, f, indent = 4)
+        f.close ()
+
+    return filenames[-1]
+
+def run_stage (stage, path, top_stratum, result_queue):
+    """
+    Run one stage in the current (child) process, doing whatever it needs
+    beforehand untimed, and put (seconds, peak RSS in KiB, growth of the peak
+    RSS during the timed section in KiB) on 'result_queue'.
+    """
+    os.chdir (path)
+    tony.stratum_graph = StratumGraph ()
+
+    jhbuild = None
+    parser = None
+    if stage == 'get-module-list':
+        jhbuild = JhbuildModules (path, ['bench.modules'], set (), cache_path = None)
+    if stage in ['sort-sources', 'add-build-depends-to-all', 'write-json']:
+        (parser, available) = tony.load_stratum_with_deps (top_stratum)
+    stratum = parser.get_root ().get_object () if parser else None
+
+    # ru_maxrss is a high-water mark, so the setup above is included in it;
+    # only what the stage itself adds on top is its own
+    rss_before = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+    start = time.time ()
+
+    if stage == 'jhbuild-parse':
+        JhbuildModules (path, ['bench.modules'], set (), cache_path = None)
+    elif stage == 'get-module-list':
+        jhbuild.get_module_list ('meta-all')
+    elif stage == 'load-stratum-with-deps':
+        tony.load_stratum_with_deps (top_stratum)
+    elif stage == 'sort-sources':
+        tony.sort_sources (stratum)
+    elif stage == 'add-build-depends-to-all':
+        for node in stratum.get_member ('chunks').get_array ().get_elements ():
+            tony.add_build_depends_to_all (node, chunk_name (0))
+    elif stage == 'write-json':
+        tony.write_json_postprocessed ('output.morph', parser.get_root ())
+
+    elapsed = time.time () - start
+    peak_rss = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+    result_queue.put ((elapsed, peak_rss, peak_rss - rss_before))
+
+def wait_for_stage (process, result_queue):
+    """
+    Returns the result run_stage() put on 'result_queue', or None if
+    'process' exited without putting one (because the stage raised).
+    """
+    while True:
+        try:
+            return result_queue.get (timeout = 1)
+        except Queue.Empty:
+            if not process.is_alive ():
+                # It may have put its result just before exiting
+                try:
+                    return result_queue.get (timeout = 1)
+                except Queue.Empty:
+                    return None
+
+def benchmark_size (size, args):
+    path = tempfile.mkdtemp (prefix = 'tony-bench-')
+    try:
+        os.mkdir (os.path.join (path, 'modulesets'))
+        graph = generate_graph (size, args.density, args.depth, args.seed)
+        write_moduleset (os.path.join (path, 'modulesets', 'bench.modules'), graph)
+        top_stratum = write_strata (path, graph, args.depth, args.strata, args.seed)
+
+        results = []
+        for stage in args.stages:
+            queue = multiprocessing.Queue ()
+            process = multiprocessing.Process (target = run_stage,
+                                               args = (stage, path, top_stratum, queue))
+            process.start ()
+            result = wait_for_stage (process, queue)
+            process.join ()
+
+            if result is None:
+                results.append ({ 'size': size, 'stage': stage,
+                                  'error': "exit code %i" % process.exitcode })
+                continue
+
+            (seconds, peak_rss, stage_rss) = result
+            results.append ({ 'size': size, 'stage': stage, 'seconds': seconds,
+                              'peak-rss-kib': peak_rss, 'stage-rss-kib': stage_rss })
+        return results
+    finally:
+        shutil.rmtree (path)
+
+def git_commit ():
+    try:
+        return subprocess.check_output (['git', 'rev-parse', 'HEAD'],
+                                        cwd = os.path.dirname (os.path.abspath (__file__)),
+                                        stderr = open (os.devnull, 'w')).strip ()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main ():
+    parser = argparse.ArgumentParser (description = "Benchmark tony on generated data")
+    parser.add_argument ('--sizes', default = '100,1000,5000',
+                         help = "comma-separated chunk counts (default: %(default)s)")
+    parser.add_argument ('--density', type = float, default = 3,
+                         help = "average build-depends per chunk (default: %(default)s)")
+    parser.add_argument ('--depth', type = int, default = 20,
+                         help = "number of dependency levels (default: %(default)s)")
+    parser.add_argument ('--strata', type = int, default = 4,
+                         help = "number of strata, at least 3 (default: %(default)s)")
+    parser.add_argument ('--seed', type = int, default = 1)
+    parser.add_argument ('--stages', default = ','.join (STAGES),
+                         help = "comma-separated stages to run (default: all)")
+    parser.add_argument ('--output', default = 'benchmark-results.json',
+                         help = "where to save results (default: %(default)s)")
+    parser.add_argument ('--compare',
+                         help = "earlier results file to compare against")
+    args = parser.parse_args ()
+
+    args.stages = args.stages.split (',')
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error ("unknown stage '%s'" % stage)
+    if args.strata < 3:
+        parser.error ("--strata must be at least 3")
+
+    baseline = {}
+    if args.compare:
+        for r in json.load (open (args.compare))['results']:
+            baseline[(r['size'], r['stage'])] = r
+
+    results = []
+    failed = False
+    print "%7s  %-26s %10s %12s %12s" % ('size', 'stage', 'seconds', 'peak KiB', 'stage KiB')
+    for size in [int (s) for s in args.sizes.split (',')]:
+        for r in benchmark_size (size, args):
+            if 'error' in r:
+                failed = True
+                print "%7i  %-26s failed (%s)" % (r['size'], r['stage'], r['error'])
+                results.append (r)
+                continue
+
+            line = "%7i  %-26s %10.4f %12i %12i" % (r['size'], r['stage'], r['seconds'],
+                                                   r['peak-rss-kib'], r['stage-rss-kib'])
+            old = baseline.get ((r['size'], r['stage']))
+            if old is not None and old.get ('seconds') > 0:
+                line += "  (x%.2f time)" % (r['seconds'] / old['seconds'])
+            print line
+            sys.stdout.flush ()
+            results.append (r)
+
+    f = open (args.output, 'w')
+    json.dump ({ 'commit': git_commit (),
+                 'time': time.strftime ('%Y-%m-%dT%H:%M:%SZ', time.gmtime ()),
+                 'parameters': { 'density': args.density, 'depth': args.depth,
+                                 'strata': args.strata, 'seed': args.seed },
+                 'results': results }, f, indent = 4)
+    f.close ()
+
+    exit (failed)
+
+if __name__ == '__main__':
+    main ()
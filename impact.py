@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+## Work out what has to rebuild when a chunk or stratum in the current
+## directory changes.
+##
+## A chunk rebuilds if anything in its build-depends rebuilds. Every chunk of
+## a stratum rebuilds if any stratum it build-depends on (directly or
+## indirectly) changes, and a system changes if any of its strata do.
+##
+## The graph is read from every *.morph file and cached, so that only files
+## whose mtime or size changed since the last query get parsed again.
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+
+import tony_cache
+from tony_stratum import load_morphologies, morph_filename
+
+IMPACT_CACHE_PATH = os.path.expanduser ('~/.cache/tony/impact')
+IMPACT_CACHE_VERSION = 1
+
+class DefinitionsGraph ():
+    """
+    The chunks, strata and systems of a definitions directory, with indexes
+    from each chunk and stratum to whatever depends on it.
+    """
+
+    def __init__ (self, filenames, cache_file = None, jobs = 1):
+        # Filename -> [mtime, size, summary] for every morphology that parsed
+        self.files = {}
+
+        if cache_file is not None:
+            self._load_cache (cache_file)
+
+        stats = {}
+        for filename in filenames:
+            st = os.stat (filename)
+            stats[filename] = [st.st_mtime, st.st_size]
+
+        for filename in list (self.files):
+            if self.files[filename][:2] != stats.get (filename):
+                del self.files[filename]
+
+        stale = sorted (f for f in stats if f not in self.files)
+        for (filename, error, summary) in load_morphologies (stale, jobs):
+            if error is not None:
+                sys.stderr.write ("Warning: ignoring %s: %s\n" % (filename, error))
+            else:
+                self.files[filename] = stats[filename] + [summary]
+
+        if cache_file is not None and stale:
+            self._save_cache (cache_file)
+
+        self._build_indexes ()
+
+    def _load_cache (self, cache_file):
+        data = tony_cache.load (cache_file)
+        if data is not None and data.get ('version') == IMPACT_CACHE_VERSION:
+            self.files = data['files']
+
+    def _save_cache (self, cache_file):
+        tony_cache.save (cache_file, { 'version': IMPACT_CACHE_VERSION, 'files': self.files })
+
+    def _build_indexes (self):
+        # Stratum filename -> list of its chunk names, in order
+        self.stratum_chunks = {}
+        # Chunk name -> list of filenames of strata that contain it
+        self.chunk_strata = {}
+        # (stratum filename, chunk name) -> chunks of that stratum which
+        # build-depend on it
+        self.chunk_dependents = {}
+        # Stratum filename -> set of strata that build-depend on it
+        self.stratum_dependents = {}
+        # Stratum filename -> set of systems that include it
+        self.stratum_systems = {}
+
+        for (filename, (mtime, size, summary)) in self.files.items ():
+            if summary['kind'] == 'stratum':
+                self.stratum_chunks[filename] = [name for (name, build_depends)
+                                                 in summary['chunks']]
+                for stratum in summary['build-depends']:
+                    self.stratum_dependents.setdefault (stratum, set ()).add (filename)
+                for (name, build_depends) in summary['chunks']:
+                    self.chunk_strata.setdefault (name, []).append (filename)
+                    for build_dep in build_depends:
+                        self.chunk_dependents.setdefault ((filename, build_dep), []).append (name)
+            elif 'strata' in summary:
+                for stratum in summary['strata']:
+                    self.stratum_systems.setdefault (stratum, set ()).add (filename)
+
+    def _closure (self, start, edges):
+        result = set (start)
+        queue = list (start)
+        while queue:
+            for dependent in edges (queue.pop ()):
+                if dependent not in result:
+                    result.add (dependent)
+                    queue.append (dependent)
+        return result
+
+    def _impact (self, chunks, strata):
+        """
+        Everything that rebuilds when the (stratum, chunk) pairs in 'chunks'
+        change and when every chunk of the strata in 'strata' changes.
+        """
+        def chunk_edges (chunk):
+            (stratum, name) = chunk
+            return [(stratum, d) for d in self.chunk_dependents.get ((stratum, name), [])]
+
+        def stratum_edges (stratum):
+            return self.stratum_dependents.get (stratum, ())
+
+        chunks = self._closure (chunks, chunk_edges)
+
+        # Strata with chunks that changed rebuild only those chunks, but
+        # anything that build-depends on them rebuilds completely
+        changed_strata = set (strata).union (stratum for (stratum, name) in chunks)
+        rebuilt_strata = set (strata).union (
+            self._closure ([d for s in changed_strata for d in stratum_edges (s)],
+                           stratum_edges))
+
+        for stratum in rebuilt_strata:
+            chunks.update ((stratum, name) for name in self.stratum_chunks.get (stratum, []))
+
+        changed_strata.update (rebuilt_strata)
+        systems = set ()
+        for stratum in changed_strata:
+            systems.update (self.stratum_systems.get (stratum, ()))
+
+        return { 'chunks': [{ 'stratum': stratum, 'name': name }
+                            for (stratum, name) in sorted (chunks)],
+                 'strata': sorted (changed_strata),
+                 'systems': sorted (systems) }
+
+    def chunk_impact (self, names):
+        """
+        What rebuilds when the chunks 'names' change, in every stratum that
+        contains them.
+        """
+        return self._impact ([(stratum, name) for name in names
+                              for stratum in self.chunk_strata.get (name, [])], [])
+
+    def stratum_impact (self, strata):
+        """
+        What rebuilds when the strata 'strata' change.
+        """
+        return self._impact ([], [morph_filename (s) for s in strata])
+
+def default_cache_file ():
+    key = hashlib.sha1 (os.path.abspath ('.')).hexdigest ()
+    return os.path.join (IMPACT_CACHE_PATH, key + '.json')
+
+def report (impact, as_json):
+    if as_json:
+        json.dump (impact, sys.stdout, indent = 4)
+        sys.stdout.write ('\n')
+    else:
+        for chunk in impact['chunks']:
+            print "chunk %s %s" % (chunk['stratum'], chunk['name'])
+        for stratum in impact['strata']:
+            print "stratum %s" % stratum
+        for system in impact['systems']:
+            print "system %s" % system
+
+def main ():
+    parser = argparse.ArgumentParser (description = "List what rebuilds when chunks or strata change")
+    parser.add_argument ('kind', choices = ['chunk', 'stratum'],
+                         help = "whether NAMES are chunks or strata")
+    parser.add_argument ('names', nargs = '+', metavar = 'NAMES')
+    parser.add_argument ('--json', action = 'store_true',
+                         help = "write a machine-readable report to stdout")
+    parser.add_argument ('--jobs', '-j', type = int,
+                         default = multiprocessing.cpu_count (),
+                         help = "number of processes used to parse morphologies")
+    parser.add_argument ('--no-cache', action = 'store_true',
+                         help = "parse every morphology, and don't update the cache")
+    args = parser.parse_args ()
+
+    cache_file = None if args.no_cache else default_cache_file ()
+    graph = DefinitionsGraph (sorted (glob.glob ('*.morph')), cache_file, args.jobs)
+
+    if args.kind == 'chunk':
+        unknown = [n for n in args.names if n not in graph.chunk_strata]
+        impact = graph.chunk_impact (args.names)
+    else:
+        unknown = [n for n in args.names if morph_filename (n) not in graph.stratum_chunks]
+        impact = graph.stratum_impact (args.names)
+
+    for name in unknown:
+        sys.stderr.write ("Unknown %s: %s\n" % (args.kind, name))
+
+    report (impact, args.json)
+    exit (len (unknown) > 0)
+
+if __name__ == '__main__':
+    main ()
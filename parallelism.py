@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+## Work out how much of a stratum or system can be built in parallel.
+##
+## Chunks are grouped into levels: a chunk's level is one more than the
+## highest level of anything it build-depends on, so the chunks in a level
+## never depend on each other and could all be built at once. The critical
+## path is the longest chain of build-depends, weighted by build times from a
+## CSV file if one is given. A suggested schedule for a number of workers
+## comes from simulating a build that always starts the ready chunk with the
+## longest chain still to come.
+##
+## For a stratum, chunks from the strata it build-depends on are taken as
+## already built. For a system, a stratum's chunks can only start once every
+## stratum it build-depends on is finished, as in morph.
+
+import argparse
+import csv
+import json
+import sys
+
+import tony
+from tony_graph import DependencyCycleError, list_schedule, longest_paths
+from tony_stratum import load_morphology
+
+def load_build_times (filename):
+    """
+    Returns dict of chunk name -> build time, from a CSV file of chunk name
+    and seconds. A header row and extra columns are ignored.
+    """
+    times = {}
+    f = open (filename)
+    for row in csv.reader (f):
+        if len (row) < 2:
+            continue
+        try:
+            times[row[0].strip ()] = float (row[1])
+        except ValueError:
+            # Header
+            continue
+    f.close ()
+    return times
+
+def build_graph (filename):
+    """
+    Returns the dependency graph for the stratum or system 'filename'. Nodes
+    are (stratum, chunk) pairs, plus a (stratum, None) node for each stratum
+    when 'filename' is a system that depends on all its chunks and marks the
+    point where the stratum is finished. Raises ValueError if 'filename' isn't
+    valid JSON.
+    """
+    (filename, error, summary) = load_morphology (filename)
+    if error is not None:
+        raise ValueError (error)
+
+    is_system = 'strata' in summary
+    if not is_system:
+        strata = [filename]
+    else:
+        strata = []
+        queue = list (summary['strata'])
+        while queue:
+            stratum = queue.pop ()
+            if stratum not in strata:
+                strata.append (stratum)
+                queue.extend (tony.stratum_graph.get_build_depends (stratum))
+
+    deps = {}
+    for stratum in strata:
+        index = tony.stratum_graph.get_chunk_index (stratum)
+        barriers = []
+        if is_system:
+            barriers = [(s, None) for s in tony.stratum_graph.get_build_depends (stratum)]
+            deps[(stratum, None)] = [(stratum, name) for name in index.names ()] + barriers
+
+        for name in index.names ():
+            deps[(stratum, name)] = [(stratum, d) for d in index.get_build_depends (name)
+                                     if d in index] + barriers
+
+    return deps
+
+def node_key (node):
+    return (node[0], '' if node[1] is None else node[1].lower (), node[1])
+
+def analyse (deps, build_times, workers):
+    chunks = [node for node in deps if node[1] is not None]
+
+    known = [build_times[name] for (stratum, name) in chunks if name in build_times]
+    if build_times:
+        # Chunks with no recorded build time are assumed to be average
+        default_time = sum (known) / len (known) if known else 1.0
+    else:
+        default_time = 1.0
+
+    def weight (node):
+        if node[1] is None:
+            return 0
+        return build_times.get (node[1], default_time)
+
+    def unit_weight (node):
+        return 0 if node[1] is None else 1
+
+    levels = {}
+    for (node, (level, via)) in longest_paths (deps, unit_weight, node_key).items ():
+        if node[1] is not None:
+            levels.setdefault (level, []).append (node)
+    levels = [sorted (levels[l], key = node_key) for l in sorted (levels)]
+
+    paths = longest_paths (deps, weight, node_key)
+    critical_path = []
+    node = max (paths, key = lambda n: (paths[n][0], node_key (n))) if paths else None
+    while node is not None:
+        if node[1] is not None:
+            critical_path.append (node)
+        node = paths[node][1]
+    critical_path.reverse ()
+
+    total_time = sum (weight (n) for n in chunks)
+    critical_time = paths[critical_path[-1]][0] if critical_path else 0
+    max_parallelism = max ([len (l) for l in levels] or [0])
+
+    if workers is None:
+        workers = max (max_parallelism, 1)
+    schedule = list_schedule (deps, weight, workers, node_key)
+    makespan = max ([finish for (start, finish, worker, node) in schedule] or [0])
+
+    # How much each extra worker helps, up to the widest level
+    scaling = []
+    n = 1
+    while True:
+        span = max ([s[1] for s in list_schedule (deps, weight, n, node_key)] or [0])
+        scaling.append ({ 'workers': n, 'time': span,
+                          'speedup': total_time / span if span else 1.0 })
+        if n >= max_parallelism:
+            break
+        n = min (n * 2, max_parallelism)
+
+    def chunk (node):
+        return { 'stratum': node[0], 'name': node[1] }
+
+    return {
+        'chunks': len (chunks),
+        'build-depends': sum (len ([d for d in deps[n] if d[1] is not None]) for n in chunks),
+        'weighted': bool (build_times),
+        'default-time': default_time,
+        'total-time': total_time,
+        'levels': [[chunk (n) for n in l] for l in levels],
+        'max-parallelism': max_parallelism,
+        'critical-path': [dict (chunk (n), time = weight (n)) for n in critical_path],
+        'critical-path-time': critical_time,
+        'serial-levels': [i + 1 for (i, l) in enumerate (levels) if len (l) == 1],
+        'scaling': scaling,
+        'schedule': {
+            'workers': workers,
+            'time': makespan,
+            'jobs': [dict (chunk (node), start = start, finish = finish, worker = worker)
+                     for (start, finish, worker, node) in schedule]
+        }
+    }
+
+def report (filename, result, show_schedule):
+    def chunk_name (c):
+        return c['name'] if c['stratum'] == filename else "%s:%s" % (c['stratum'], c['name'])
+
+    unit = 's' if result['weighted'] else ' chunks'
+
+    print "%s: %i chunks, %i build-depends" % (filename, result['chunks'], result['build-depends'])
+    print
+    print "Levels:"
+    for (i, level) in enumerate (result['levels']):
+        print "  %3i  %4i  %s" % (i + 1, len (level), ", ".join (chunk_name (c) for c in level))
+    print
+    print "Maximum parallelism: %i" % result['max-parallelism']
+    if result['serial-levels']:
+        print "Levels with only one chunk: %s" % \
+            ", ".join (str (l) for l in result['serial-levels'])
+    print
+    print "Critical path (%g%s of %g%s in total):" % \
+        (result['critical-path-time'], unit, result['total-time'], unit)
+    for c in result['critical-path']:
+        if result['weighted']:
+            print "  %10g  %s" % (c['time'], chunk_name (c))
+        else:
+            print "  %s" % chunk_name (c)
+    print
+    print "Workers  %10s  speedup" % ('time')
+    for s in result['scaling']:
+        print "%7i  %10g  %7.2f" % (s['workers'], s['time'], s['speedup'])
+
+    if show_schedule:
+        schedule = result['schedule']
+        print
+        print "Schedule for %i workers (%g%s):" % (schedule['workers'], schedule['time'], unit)
+        for job in schedule['jobs']:
+            print "  %10g  %10g  %4i  %s" % (job['start'], job['finish'],
+                                             job['worker'], chunk_name (job))
+
+def main ():
+    parser = argparse.ArgumentParser (description = "Analyse build parallelism of a stratum or system")
+    parser.add_argument ('morphology', metavar = 'MORPHOLOGY',
+                         help = "stratum or system morphology")
+    parser.add_argument ('--build-times', metavar = 'CSV',
+                         help = "chunk build times in seconds, as 'chunk,seconds' lines")
+    parser.add_argument ('--workers', '-w', type = int,
+                         help = "workers to schedule for (default: the maximum parallelism)")
+    parser.add_argument ('--schedule', action = 'store_true',
+                         help = "print the suggested schedule")
+    parser.add_argument ('--json', action = 'store_true',
+                         help = "write a machine-readable report to stdout")
+    args = parser.parse_args ()
+
+    if args.workers is not None and args.workers < 1:
+        parser.error ("--workers must be at least 1")
+
+    build_times = {}
+    if args.build_times:
+        build_times = load_build_times (args.build_times)
+
+    try:
+        result = analyse (build_graph (args.morphology), build_times, args.workers)
+    except (DependencyCycleError, ValueError) as e:
+        sys.stderr.write ("%s: %s\n" % (args.morphology, e))
+        exit (1)
+
+    if args.json:
+        json.dump (result, sys.stdout, indent = 4)
+        sys.stdout.write ('\n')
+    else:
+        report (args.morphology, result, args.schedule)
+
+if __name__ == '__main__':
+    main ()
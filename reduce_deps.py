@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+## Remove build-depends that are implied by a chunk's other build-depends from
+## existing strata. A chunk keeps 'a' in its build-depends only if none of its
+## other build-depends already needs 'a', directly or indirectly.
+##
+## Chunks stay in the same order, as do the build-depends that remain, and a
+## file is only rewritten if something was removed.
+
+import argparse
+import json
+import sys
+
+import tony
+from tony_edit import ChunkIndex
+from tony_graph import DependencyCycleError
+
+def reduce_stratum (filename, dry_run):
+    """
+    Returns tuple of (number of build-depends before, list of (chunk,
+    build-dep) pairs that were removed).
+    """
+    parser = tony.stratum_graph.get_parser (filename)
+    stratum = parser.get_root ().get_object ()
+    index = ChunkIndex (stratum)
+
+    before = dict ((name, list (index.get_build_depends (name))) for name in index.names ())
+    tony.reduce_build_depends (stratum, index)
+
+    removed = []
+    for name in index.names ():
+        kept = set (index.get_build_depends (name))
+        removed.extend ((name, d) for d in before[name] if d not in kept)
+
+    if removed and not dry_run:
+        tony.write_json_postprocessed (filename, parser.get_root ())
+
+    return (sum (len (b) for b in before.values ()), removed)
+
+def main ():
+    parser = argparse.ArgumentParser (description = "Remove redundant build-depends from strata")
+    parser.add_argument ('strata', nargs = '+', metavar = 'STRATUM')
+    parser.add_argument ('--dry-run', '-n', action = 'store_true',
+                         help = "report what would be removed, but don't change any files")
+    parser.add_argument ('--verbose', '-v', action = 'store_true',
+                         help = "list each build-dep that is removed")
+    parser.add_argument ('--json', action = 'store_true',
+                         help = "write a machine-readable report to stdout")
+    args = parser.parse_args ()
+
+    results = []
+    failed = False
+    for filename in args.strata:
+        try:
+            (total, removed) = reduce_stratum (filename, args.dry_run)
+        except DependencyCycleError as e:
+            sys.stderr.write ("%s: %s\n" % (filename, e))
+            failed = True
+            continue
+
+        results.append ({ 'file': filename, 'build-depends': total,
+                          'removed': [{ 'chunk': c, 'build-dep': d } for (c, d) in removed] })
+        if not args.json:
+            print "%s: removed %i of %i build-depends" % (filename, len (removed), total)
+            if args.verbose:
+                for (chunk, build_dep) in removed:
+                    print "    %s: %s" % (chunk, build_dep)
+
+    if args.json:
+        json.dump ({ 'dry-run': args.dry_run, 'strata': results },
+                   sys.stdout, indent = 4)
+        sys.stdout.write ('\n')
+
+    exit (failed)
+
+if __name__ == '__main__':
+    main ()
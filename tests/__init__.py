@@ -0,0 +1,35 @@
+## Fixtures shared by the tests.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+class DefinitionsTestCase (unittest.TestCase):
+    """
+    Runs each test in a new, empty temporary directory, which write_stratum()
+    fills with morphologies.
+    """
+
+    def setUp (self):
+        self.old_cwd = os.getcwd ()
+        self.path = tempfile.mkdtemp ()
+        os.chdir (self.path)
+
+    def tearDown (self):
+        os.chdir (self.old_cwd)
+        shutil.rmtree (self.path)
+
+    def write_stratum (self, name, build_depends, chunks):
+        """
+        Write '<name>.morph', build-depending on the strata named in
+        'build_depends', with the list of (chunk name, build-depends) pairs
+        'chunks'.
+        """
+        f = open (name + '.morph', 'w')
+        json.dump ({ 'name': name, 'kind': 'stratum',
+                     'build-depends': [{ 'morph': s } for s in build_depends],
+                     'chunks': [{ 'name': c, 'build-depends': deps } for (c, deps) in chunks] },
+                   f)
+        f.close ()
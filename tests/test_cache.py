@@ -0,0 +1,51 @@
+## Tests for the JSON cache entries in tony_cache.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+import tony_cache
+
+class CacheTest (unittest.TestCase):
+    def setUp (self):
+        self.path = tempfile.mkdtemp ()
+
+    def tearDown (self):
+        shutil.rmtree (self.path)
+
+    def entry (self, name):
+        return os.path.join (self.path, 'cache', name + '.json')
+
+    def test_round_trip (self):
+        self.assertEqual (tony_cache.load (self.entry ('a')), None)
+        tony_cache.save (self.entry ('a'), { 'files': [1, 2] })
+        self.assertEqual (tony_cache.load (self.entry ('a')), { 'files': [1, 2] })
+        self.assertEqual (os.listdir (os.path.join (self.path, 'cache')), ['a.json'])
+
+    def test_corrupt (self):
+        tony_cache.save (self.entry ('a'), {})
+        open (self.entry ('a'), 'w').write ('{ "files": ')
+
+        stderr = sys.stderr
+        sys.stderr = StringIO ()
+        try:
+            self.assertEqual (tony_cache.load (self.entry ('a')), None)
+            self.assertTrue ('corrupt cache' in sys.stderr.getvalue ())
+        finally:
+            sys.stderr = stderr
+
+    def test_evicts_least_recently_used (self):
+        for (i, name) in enumerate (['a', 'b', 'c']):
+            tony_cache.save (self.entry (name), {})
+            os.utime (self.entry (name), (1000 + i, 1000 + i))
+        # Reading 'a' makes it the most recently used
+        tony_cache.load (self.entry ('a'))
+        tony_cache.save (self.entry ('d'), {}, max_entries = 3)
+        self.assertEqual (sorted (os.listdir (os.path.join (self.path, 'cache'))),
+                          ['a.json', 'c.json', 'd.json'])
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,135 @@
+## Tests for ChunkIndex, edit_chunk() and StratumEditor in tony_edit.
+
+import json
+import unittest
+from collections import OrderedDict
+
+from tony_edit import ChunkIndex, StratumEditor, edit_chunk
+from tony_json import Json
+
+def chunk (*members):
+    """
+    A chunk, with its members in the order given as (key, value) pairs
+    """
+    return OrderedDict (members)
+
+def parse_stratum (chunks):
+    parser = Json.Parser ()
+    parser.load_from_data (json.dumps (OrderedDict ([('name', 'test'), ('kind', 'stratum'),
+                                                     ('chunks', chunks)])))
+    return parser.get_root ().get_object ()
+
+def parse_chunk (members):
+    return parse_stratum ([members]).get_array_member ('chunks').get_elements ()[0].get_object ()
+
+def keys (chunk_object):
+    return list (chunk_object.get_members ())
+
+def build_depends (chunk_object):
+    return [bd.get_string () for bd in chunk_object.get_array_member ('build-depends').get_elements ()]
+
+class EditChunkTest (unittest.TestCase):
+    def test_new_repo_keeps_key_order (self):
+        chunk_object = parse_chunk (chunk (('name', 'glib'), ('ref', 'master'), ('build-depends', [])))
+        self.assertTrue (edit_chunk (chunk_object, repo = 'upstream:glib'))
+        self.assertEqual (keys (chunk_object), ['name', 'repo', 'ref', 'build-depends'])
+
+    def test_new_ref_keeps_key_order (self):
+        chunk_object = parse_chunk (chunk (('name', 'glib'), ('repo', 'upstream:glib'),
+                                           ('build-depends', [])))
+        self.assertTrue (edit_chunk (chunk_object, repo = 'upstream:glib', ref = 'master'))
+        self.assertEqual (keys (chunk_object), ['name', 'repo', 'ref', 'build-depends'])
+
+    def test_new_repo_and_ref (self):
+        chunk_object = parse_chunk (chunk (('name', 'glib'), ('build-depends', ['zlib']),
+                                           ('morph', 'glib')))
+        self.assertTrue (edit_chunk (chunk_object, repo = 'upstream:glib', ref = 'master'))
+        self.assertEqual (keys (chunk_object), ['name', 'morph', 'repo', 'ref', 'build-depends'])
+        self.assertEqual (build_depends (chunk_object), ['zlib'])
+
+    def test_default_repo (self):
+        chunk_object = parse_chunk (chunk (('name', 'glib'), ('ref', 'master'), ('build-depends', [])))
+        self.assertTrue (edit_chunk (chunk_object, default_repo = 'upstream:%s'))
+        self.assertEqual (keys (chunk_object), ['name', 'repo', 'ref', 'build-depends'])
+        self.assertEqual (chunk_object.get_string_member ('repo'), 'upstream:glib')
+        self.assertFalse (edit_chunk (chunk_object, default_repo = 'other:%s'))
+
+    def test_existing_repo_changed_in_place (self):
+        chunk_object = parse_chunk (chunk (('name', 'glib'), ('repo', 'a'), ('ref', 'master'),
+                                           ('build-depends', [])))
+        self.assertTrue (edit_chunk (chunk_object, repo = 'b'))
+        self.assertEqual (keys (chunk_object), ['name', 'repo', 'ref', 'build-depends'])
+        self.assertFalse (edit_chunk (chunk_object, repo = 'b'))
+
+class StratumEditorTest (unittest.TestCase):
+    def setUp (self):
+        self.stratum = parse_stratum ([
+            chunk (('name', 'glib'), ('repo', 'upstream:glib'), ('ref', 'master'),
+                   ('build-depends', [])),
+            chunk (('name', 'pango'), ('repo', 'upstream:pango'), ('ref', 'master'),
+                   ('build-depends', ['glib'])),
+            chunk (('name', 'gtk'), ('repo', 'upstream:gtk'), ('ref', 'master'),
+                   ('build-depends', ['pango', 'glib']))])
+        self.index = ChunkIndex (self.stratum)
+
+        # Count replaced build-depends arrays, by chunk name
+        self.replaced = {}
+        self.set_array_member = Json.Object.set_array_member
+        test = self
+        def set_array_member (object, name, value):
+            if name == 'build-depends':
+                chunk_name = object.get_member ('name').get_string ()
+                test.replaced[chunk_name] = test.replaced.get (chunk_name, 0) + 1
+            return test.set_array_member (object, name, value)
+        Json.Object.set_array_member = set_array_member
+
+    def tearDown (self):
+        Json.Object.set_array_member = self.set_array_member
+
+    def chunk (self, name):
+        return self.index.get (name)
+
+    def test_merged_edits (self):
+        editor = StratumEditor (self.stratum, self.index)
+        editor.add_build_depend ('zlib')
+        editor.add_build_depend ('cairo', ['pango', 'gtk'])
+        editor.remove_build_depend ('glib', ['gtk'])
+        editor.sort_build_depends (['gtk'])
+        self.assertEqual (editor.apply (), ['glib', 'pango', 'gtk'])
+
+        self.assertEqual (build_depends (self.chunk ('glib')), ['zlib'])
+        self.assertEqual (build_depends (self.chunk ('pango')), ['cairo', 'glib', 'zlib'])
+        self.assertEqual (build_depends (self.chunk ('gtk')), ['cairo', 'pango', 'zlib'])
+        self.assertEqual (self.index.get_dependents ('zlib'), set (['glib', 'pango', 'gtk']))
+        self.assertEqual (self.index.get_dependents ('glib'), set (['pango']))
+
+        # However many edits touched it, each array was replaced once
+        self.assertEqual (self.replaced, { 'glib': 1, 'pango': 1, 'gtk': 1 })
+
+    def test_no_change (self):
+        editor = StratumEditor (self.stratum, self.index)
+        editor.add_build_depend ('glib', ['pango', 'gtk'])
+        editor.remove_build_depend ('zlib')
+        self.assertEqual (editor.apply (), [])
+        self.assertEqual (self.replaced, {})
+
+    def test_named_chunks_in_stratum_order (self):
+        editor = StratumEditor (self.stratum, self.index)
+        editor.set_repo ('gtk', 'gnome:gtk', 'gtk-3-8')
+        editor.add_build_depend ('glib', ['glib'])
+        editor.remove_build_depend ('glib', ['pango'])
+        self.assertEqual (editor.apply (), ['pango', 'gtk'])
+        self.assertEqual (self.chunk ('gtk').get_string_member ('repo'), 'gnome:gtk')
+        self.assertEqual (self.chunk ('gtk').get_string_member ('ref'), 'gtk-3-8')
+        self.assertEqual (keys (self.chunk ('gtk')), ['name', 'repo', 'ref', 'build-depends'])
+
+        # The edits are forgotten once applied
+        self.assertEqual (editor.apply (), [])
+
+    def test_set_repo_on_chunk_without_ref (self):
+        self.chunk ('glib').remove_member ('ref')
+        StratumEditor (self.stratum).set_repo ('glib', 'upstream:glib', 'master').apply ()
+        self.assertEqual (keys (self.chunk ('glib')), ['name', 'repo', 'ref', 'build-depends'])
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,214 @@
+## Tests for tony_fedora: RPM spec file parsing, the index of a repository's
+## primary metadata (data/primary.xml), and fetching spec files from a local
+## HTTP server.
+
+import BaseHTTPServer
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from cStringIO import StringIO
+
+from tony_fedora import FedoraPackageDB, FedoraRepoIndex, SpecFetcher, parse_build_requires
+
+DATA_DIR = os.path.join (os.path.dirname (os.path.abspath (__file__)), 'data')
+
+class ParseBuildRequiresTest (unittest.TestCase):
+    def test_versions_and_macros (self):
+        spec = ("%global glib_version 2.34\n"
+                "BuildRequires: glib2-devel >= %{glib_version}, pkgconfig(x11)\n"
+                "BuildRequires: gettext >= 0.18 intltool\n")
+        self.assertEqual (parse_build_requires (spec),
+                          ['glib2-devel', 'pkgconfig(x11)', 'gettext', 'intltool'])
+
+    def test_known_conditions (self):
+        spec = ("%global with_docs 0\n"
+                "%if %{with_docs}\n"
+                "BuildRequires: gtk-doc\n"
+                "%else\n"
+                "BuildRequires: no-docs\n"
+                "%endif\n"
+                "%if ! %{with_docs}\n"
+                "BuildRequires: also-no-docs\n"
+                "%endif\n")
+        self.assertEqual (parse_build_requires (spec), ['no-docs', 'also-no-docs'])
+
+    def test_distribution_conditions (self):
+        # %{?fedora} and %{?rhel} are defined by the build system, not the
+        # spec, so every branch that depends on them has to be kept.
+        spec = ("BuildRequires: always-devel\n"
+                "%if 0%{?fedora}\n"
+                "BuildRequires: fedora-devel\n"
+                "%endif\n"
+                "%if 0%{?fedora} >= 17\n"
+                "BuildRequires: new-devel\n"
+                "%else\n"
+                "BuildRequires: old-devel\n"
+                "%endif\n"
+                "%if 0%{?rhel}\n"
+                "BuildRequires: rhel-devel\n"
+                "%endif\n")
+        self.assertEqual (parse_build_requires (spec),
+                          ['always-devel', 'fedora-devel', 'new-devel',
+                           'old-devel', 'rhel-devel'])
+
+    def test_nested_conditions (self):
+        spec = ("%global with_x 0\n"
+                "%if 0%{?fedora}\n"
+                "%if %{with_x}\n"
+                "BuildRequires: x-devel\n"
+                "%endif\n"
+                "BuildRequires: fedora-devel\n"
+                "%endif\n")
+        self.assertEqual (parse_build_requires (spec), ['fedora-devel'])
+
+class FedoraRepoIndexTest (unittest.TestCase):
+    def setUp (self):
+        self.index = FedoraRepoIndex (os.path.join (DATA_DIR, 'primary.xml'))
+
+    def test_packages_exist (self):
+        # Source packages don't count
+        self.assertEqual (self.index.packages_exist (['glib2-devel', 'glib2', 'gtk3-devel', 'nope']),
+                          set (['glib2-devel', 'gtk3-devel']))
+
+    def test_whatprovides (self):
+        self.assertEqual (self.index.whatprovides ('gtk', 'pkgconfig(glib-2.0)'), 'glib2-devel')
+        self.assertEqual (self.index.whatprovides ('gtk', 'pkgconfig(gtk+-3.0)'), 'gtk3-devel')
+        self.assertEqual (self.index.whatprovides ('gtk', '/usr/bin/glib-mkenums'), 'glib2-devel')
+        # The first by name, when several packages provide it
+        self.assertEqual (self.index.whatprovides ('gtk', 'perl(XML::Parser)'), 'compat-XML-Parser')
+
+    def test_whatprovides_nothing (self):
+        stdout = sys.stdout
+        sys.stdout = StringIO ()
+        try:
+            self.assertEqual (self.index.whatprovides ('gtk', 'glib2-source'), None)
+            self.assertEqual (sys.stdout.getvalue (), "Warning: gtk: nothing provides glib2-source\n")
+        finally:
+            sys.stdout = stdout
+
+    def test_gzip (self):
+        path = tempfile.mkdtemp ()
+        try:
+            gz_path = os.path.join (path, 'primary.xml.gz')
+            f = gzip.open (gz_path, 'w')
+            f.write (open (os.path.join (DATA_DIR, 'primary.xml')).read ())
+            f.close ()
+
+            index = FedoraRepoIndex (gz_path)
+            self.assertEqual (index.packages, self.index.packages)
+            self.assertEqual (index.provides, self.index.provides)
+        finally:
+            shutil.rmtree (path)
+
+class SpecHandler (BaseHTTPServer.BaseHTTPRequestHandler):
+    SPEC = "BuildRequires: glib2-devel\n"
+
+    def do_GET (self):
+        server = self.server
+        server.requests.append ((self.path, self.headers.getheader ('If-None-Match')))
+
+        if self.path == '/glib2.spec':
+            if self.headers.getheader ('If-None-Match') == '"v1"':
+                self.send_response (304)
+                self.end_headers ()
+                return
+            self.send_response (200)
+            self.send_header ('ETag', '"v1"')
+            self.send_header ('Content-Length', str (len (self.SPEC)))
+            self.end_headers ()
+            self.wfile.write (self.SPEC)
+        elif self.path == '/truncated.spec':
+            server.truncated_count += 1
+            self.send_response (200)
+            self.send_header ('Content-Length', str (len (self.SPEC)))
+            self.end_headers ()
+            if server.truncated_count == 1:
+                # Connection closes after this, part way through the body
+                self.wfile.write (self.SPEC[:5])
+            else:
+                self.wfile.write (self.SPEC)
+        else:
+            self.send_error (404)
+
+    def log_message (self, format, *args):
+        pass
+
+class SpecFetcherTest (unittest.TestCase):
+    def setUp (self):
+        self.server = BaseHTTPServer.HTTPServer (('127.0.0.1', 0), SpecHandler)
+        self.server.requests = []
+        self.server.truncated_count = 0
+        self.thread = threading.Thread (target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start ()
+
+        self.path = tempfile.mkdtemp ()
+        self.fetcher = SpecFetcher (attempts = 2)
+
+        # The fetcher reports failures on stdout
+        self.stdout = sys.stdout
+        sys.stdout = StringIO ()
+
+    def tearDown (self):
+        sys.stdout = self.stdout
+        self.server.shutdown ()
+        self.server.server_close ()
+        shutil.rmtree (self.path)
+
+    def url (self, name):
+        return 'http://127.0.0.1:%i/%s' % (self.server.server_port, name)
+
+    def read (self, name):
+        f = open (os.path.join (self.path, name))
+        try:
+            return f.read ()
+        finally:
+            f.close ()
+
+    def test_revalidation (self):
+        filename = os.path.join (self.path, 'glib2.spec')
+        self.assertTrue (self.fetcher.fetch (self.url ('glib2.spec'), filename))
+        self.assertEqual (self.read ('glib2.spec'), SpecHandler.SPEC)
+        self.assertEqual (self.read ('glib2.spec.headers'), '{"ETag": "\\"v1\\""}')
+
+        self.assertTrue (self.fetcher.fetch (self.url ('glib2.spec'), filename))
+        self.assertEqual (self.server.requests,
+                          [('/glib2.spec', None), ('/glib2.spec', '"v1"')])
+        self.assertEqual (self.read ('glib2.spec'), SpecHandler.SPEC)
+
+    def test_truncated_body_is_retried (self):
+        filename = os.path.join (self.path, 'truncated.spec')
+        self.assertTrue (self.fetcher.fetch (self.url ('truncated.spec'), filename))
+        self.assertEqual (self.server.truncated_count, 2)
+        self.assertEqual (self.read ('truncated.spec'), SpecHandler.SPEC)
+
+    def test_not_found (self):
+        downloads = [(self.url ('missing.spec'), os.path.join (self.path, 'missing.spec')),
+                     (self.url ('glib2.spec'), os.path.join (self.path, 'glib2.spec'))]
+        self.assertEqual (self.fetcher.fetch_all (downloads), downloads[:1])
+        self.assertEqual (sorted (os.listdir (self.path)), ['glib2.spec', 'glib2.spec.headers'])
+        # Not retried, as the server said it doesn't exist
+        self.assertEqual (len ([r for r in self.server.requests if r[0] == '/missing.spec']), 1)
+
+    def test_package_without_spec_has_no_build_depends (self):
+        class RepoIndex ():
+            def packages_exist (self, names):
+                return set (names)
+
+        test = self
+        class PackageDB (FedoraPackageDB):
+            def get_spec_file_url (self, name):
+                return test.url ('missing-%s.spec' % name)
+
+        db = PackageDB (self.path, ['gtk3', 'glib2'], RepoIndex ())
+        self.assertEqual (db.get_build_depends ('gtk3'), [])
+        self.assertEqual (db.failed_spec_files,
+                          set ([os.path.join (self.path, 'glib2.spec'),
+                                os.path.join (self.path, 'gtk3.spec')]))
+
+if __name__ == '__main__':
+    unittest.main ()
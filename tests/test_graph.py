@@ -0,0 +1,125 @@
+## Tests for the dependency graph algorithms in tony_graph.
+
+import random
+import unittest
+
+from tony_graph import DependencyCycleError, chunk_sort_key, list_schedule, longest_paths, \
+                       topological_sort, transitive_reduction
+
+def pass_sort (deps):
+    """
+    The "try-try-again" sort that topological_sort() replaced: passes over
+    the nodes in sorted order, each taking every node whose dependencies
+    have been taken, until none are left.
+    """
+    remaining = sorted (deps, key = chunk_sort_key)
+    taken = []
+    while remaining:
+        left = []
+        for name in remaining:
+            if all (d in taken or d not in deps for d in deps[name]):
+                taken.append (name)
+            else:
+                left.append (name)
+        remaining = left
+    return taken
+
+class TopologicalSortTest (unittest.TestCase):
+    def test_documented_order (self):
+        # 'a' waits for the next pass, as 'c' sorts after it
+        self.assertEqual (topological_sort ({ 'a': ['c'], 'b': [], 'c': [], 'd': [] }),
+                          ['b', 'c', 'd', 'a'])
+
+    def test_case_insensitive (self):
+        self.assertEqual (topological_sort ({ 'b': [], 'A': [], 'a': [], 'C': [] }),
+                          ['A', 'a', 'b', 'C'])
+
+    def test_cycle_lists_only_its_members (self):
+        deps = { 'a': ['b'], 'b': ['c'], 'c': ['a'], 'd': ['a'], 'e': [] }
+        try:
+            topological_sort (deps)
+            self.fail ("no DependencyCycleError")
+        except DependencyCycleError as e:
+            self.assertEqual (e.cycles, [['a', 'b', 'c']])
+
+    def test_dep_outside_stratum_is_kept (self):
+        self.assertEqual (topological_sort ({ 'gtk': ['glib', 'pango'], 'pango': ['glib'] }),
+                          ['pango', 'gtk'])
+
+    def test_same_order_as_pass_sort (self):
+        rng = random.Random (1)
+        for size in [5, 20, 100]:
+            for attempt in range (20):
+                names = ['%s%i' % (rng.choice ('aBc'), i) for i in range (size)]
+                rng.shuffle (names)
+                # Dependencies point to earlier names, so there's no cycle,
+                # plus some that are outside the graph
+                deps = dict ((name, rng.sample (names[:i], min (i, rng.randint (0, 3))) +
+                                    (['outside'] if rng.random () < 0.1 else []))
+                             for (i, name) in enumerate (names))
+                self.assertEqual (topological_sort (deps), pass_sort (deps))
+
+## glib is reachable from gtk and pango through other build-depends; x11 is
+## from another stratum. The lists are deliberately not sorted.
+##
+GTK_DEPS = {
+    'glib': [],
+    'cairo': ['glib', 'x11'],
+    'pango': ['glib', 'cairo'],
+    'atk': ['glib'],
+    'gtk': ['pango', 'x11', 'glib', 'atk', 'cairo'],
+}
+
+class TransitiveReductionTest (unittest.TestCase):
+    def test_reduction (self):
+        self.assertEqual (transitive_reduction (GTK_DEPS), {
+            'glib': [],
+            'cairo': ['glib', 'x11'],
+            'pango': ['cairo'],
+            'atk': ['glib'],
+            # x11 stays, although cairo depends on it too
+            'gtk': ['pango', 'x11', 'atk'],
+        })
+
+    def test_cycle (self):
+        self.assertRaises (DependencyCycleError, transitive_reduction,
+                           { 'a': ['b'], 'b': ['a'] })
+
+## 'z' stands for the end of a stratum, which takes no time
+##
+BUILD_DEPS = { 'a': [], 'b': ['a'], 'c': ['a'], 'd': ['b', 'c'], 'e': [], 'z': ['d', 'e'] }
+BUILD_TIMES = { 'a': 2, 'b': 5, 'c': 1, 'd': 1, 'e': 3, 'z': 0 }
+
+class ScheduleTest (unittest.TestCase):
+    def test_levels (self):
+        self.assertEqual (longest_paths (BUILD_DEPS, lambda n: 1), {
+            'a': (1, None), 'b': (2, 'a'), 'c': (2, 'a'), 'd': (3, 'b'),
+            'e': (1, None), 'z': (4, 'd') })
+
+    def test_critical_path (self):
+        paths = longest_paths (BUILD_DEPS, BUILD_TIMES.get)
+        self.assertEqual (paths['z'], (8, 'd'))
+        self.assertEqual (paths['c'], (3, 'a'))
+
+        path = []
+        node = 'z'
+        while node is not None:
+            path.append (node)
+            node = paths[node][1]
+        self.assertEqual (path, ['z', 'd', 'b', 'a'])
+
+    def test_schedule (self):
+        # The longest chain first: 'b' before 'c', and 'e' as soon as
+        # there's a free worker; 'z' takes no worker
+        self.assertEqual (list_schedule (BUILD_DEPS, BUILD_TIMES.get, 2),
+                          [(0, 2, 0, 'a'), (0, 3, 1, 'e'), (2, 7, 0, 'b'),
+                           (3, 4, 1, 'c'), (7, 8, 0, 'd')])
+        self.assertEqual (list_schedule (BUILD_DEPS, BUILD_TIMES.get, 1),
+                          [(0, 2, 0, 'a'), (2, 7, 0, 'b'), (7, 10, 0, 'e'),
+                           (10, 11, 0, 'c'), (11, 12, 0, 'd')])
+
+    def test_no_workers (self):
+        self.assertRaises (ValueError, list_schedule, BUILD_DEPS, BUILD_TIMES.get, 0)
+
+if __name__ == '__main__':
+    unittest.main ()
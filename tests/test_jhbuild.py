@@ -0,0 +1,69 @@
+## Tests for the jhbuild moduleset reader and its cache in tony_jhbuild.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from tony_jhbuild import JhbuildModules
+
+MODULESET = '''<?xml version="1.0" encoding="UTF-8"?>
+<moduleset>
+  <repository type="git" name="git.gnome.org" default="yes" href="git://git.gnome.org/"/>
+  <autotools id="glib"><branch/></autotools>
+  <autotools id="gnome-t\xc3\xaate">
+    <branch repo="nowhere"/>
+    <dependencies><dep package="glib"/></dependencies>
+  </autotools>
+  <metamodule id="meta-gnome"><dependencies><dep package="gnome-t\xc3\xaate"/></dependencies></metamodule>
+</moduleset>
+'''
+
+class JhbuildCacheTest (unittest.TestCase):
+    def setUp (self):
+        self.path = tempfile.mkdtemp ()
+        os.mkdir (os.path.join (self.path, 'modulesets'))
+        f = open (os.path.join (self.path, 'modulesets', 'gnome.modules'), 'w')
+        f.write (MODULESET)
+        f.close ()
+
+        self.stdout = sys.stdout
+        sys.stdout = StringIO ()
+
+    def tearDown (self):
+        sys.stdout = self.stdout
+        shutil.rmtree (self.path)
+
+    def load (self):
+        return JhbuildModules (self.path, ['gnome.modules'], set (),
+                               cache_path = os.path.join (self.path, 'cache'))
+
+    def strings (self, jhbuild):
+        result = list (jhbuild.warnings)
+        for (module, deps) in jhbuild.module_deps.items ():
+            result.append (module)
+            result.extend (deps)
+        for (module, repo) in jhbuild.module_repos.items ():
+            result.append (module)
+            if repo is not None:
+                result.append (repo)
+        result.extend (jhbuild.get_module_list ('meta-gnome'))
+        return result
+
+    def test_cold_and_warm_runs_agree (self):
+        cold = self.load ()
+        warm = self.load ()
+        self.assertEqual (os.listdir (os.path.join (self.path, 'cache'))[0][-5:], '.json')
+
+        self.assertEqual (self.strings (warm), self.strings (cold))
+        self.assertTrue ('gnome-t\xc3\xaate' in warm.get_module_list ('meta-gnome'))
+        for s in self.strings (cold) + self.strings (warm):
+            self.assertTrue (isinstance (s, str), repr (s))
+
+        # The warning is printed again from the cache
+        self.assertEqual (sys.stdout.getvalue ().count ('gnome-t\xc3\xaate: Unknown repo: nowhere\n'), 2)
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,73 @@
+## Golden-file tests for the morphology writer in tony_json.
+##
+## data/stratum.expected.morph is what the old write_json_postprocessed(),
+## JSON-GLib's generator followed by two regex passes, writes for
+## data/stratum.morph. test_matches_json_glib checks that against the real
+## thing wherever JSON-GLib is installed.
+
+import os
+import re
+import unittest
+from cStringIO import StringIO
+
+import tony_json
+
+DATA_DIR = os.path.join (os.path.dirname (os.path.abspath (__file__)), 'data')
+
+def read_data (name):
+    f = open (os.path.join (DATA_DIR, name))
+    try:
+        return f.read ()
+    finally:
+        f.close ()
+
+def old_write_json_postprocessed (root_node):
+    """
+    What write_json_postprocessed() produced before the direct emitter.
+    """
+    from gi.repository import Json
+
+    generator = Json.Generator ()
+    generator.set_indent (4)
+    generator.set_pretty (True)
+    generator.set_root (root_node)
+
+    output = generator.to_data ()[0]
+    output = re.sub ('(\s+"[A-Za-z0-9-_]+") : ', '\\1: ', output)
+    output = re.sub (': \[\s+\]', ': []', output)
+    return output + "\n"
+
+class DumpMorphologyTest (unittest.TestCase):
+    def dump (self, root_node):
+        out = StringIO ()
+        tony_json.dump_morphology (out, root_node)
+        return out.getvalue ()
+
+    def test_golden_file (self):
+        parser = tony_json.Json.Parser ()
+        parser.load_from_file (os.path.join (DATA_DIR, 'stratum.morph'))
+        self.assertEqual (self.dump (parser.get_root ()),
+                          read_data ('stratum.expected.morph'))
+
+    def test_output_is_stable (self):
+        parser = tony_json.Json.Parser ()
+        parser.load_from_file (os.path.join (DATA_DIR, 'stratum.expected.morph'))
+        self.assertEqual (self.dump (parser.get_root ()),
+                          read_data ('stratum.expected.morph'))
+
+    def test_matches_json_glib (self):
+        try:
+            from gi.repository import Json
+        except ImportError:
+            raise unittest.SkipTest ("JSON-GLib is not available")
+
+        parser = Json.Parser ()
+        parser.load_from_file (os.path.join (DATA_DIR, 'stratum.morph'))
+        self.assertEqual (old_write_json_postprocessed (parser.get_root ()),
+                          read_data ('stratum.expected.morph'))
+        if tony_json.JSON_BACKEND == 'glib':
+            self.assertEqual (self.dump (parser.get_root ()),
+                              read_data ('stratum.expected.morph'))
+
+if __name__ == '__main__':
+    unittest.main ()
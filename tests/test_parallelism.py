@@ -0,0 +1,43 @@
+## Tests for the report that parallelism.py builds from a dependency graph.
+
+import unittest
+
+import parallelism
+
+## Two strata of a system: 'gtk' can't start until 'core' is finished
+##
+DEPS = {
+    ('core', None): [('core', 'glib'), ('core', 'zlib')],
+    ('core', 'glib'): [('core', 'zlib')],
+    ('core', 'zlib'): [],
+    ('gtk', None): [('gtk', 'gtk'), ('gtk', 'pango'), ('core', None)],
+    ('gtk', 'pango'): [('core', None)],
+    ('gtk', 'gtk'): [('gtk', 'pango'), ('core', None)],
+}
+
+def names (chunks):
+    return ["%s:%s" % (c['stratum'], c['name']) for c in chunks]
+
+class AnalyseTest (unittest.TestCase):
+    def test_unweighted (self):
+        result = parallelism.analyse (DEPS, {}, None)
+        self.assertEqual ([names (l) for l in result['levels']],
+                          [['core:zlib'], ['core:glib'], ['gtk:pango'], ['gtk:gtk']])
+        self.assertEqual (names (result['critical-path']),
+                          ['core:zlib', 'core:glib', 'gtk:pango', 'gtk:gtk'])
+        self.assertEqual (result['critical-path-time'], 4)
+        self.assertEqual (result['serial-levels'], [1, 2, 3, 4])
+
+    def test_weighted (self):
+        result = parallelism.analyse (DEPS, { 'glib': 10.0, 'pango': 4.0, 'gtk': 22.0 }, 2)
+        # zlib has no build time, so is taken to be average
+        self.assertEqual (result['default-time'], 12.0)
+        self.assertEqual (result['total-time'], 48.0)
+        self.assertEqual (result['critical-path-time'], 48.0)
+        self.assertEqual ([(j['name'], j['start'], j['finish'], j['worker'])
+                           for j in result['schedule']['jobs']],
+                          [('zlib', 0, 12.0, 0), ('glib', 12.0, 22.0, 0),
+                           ('pango', 22.0, 26.0, 0), ('gtk', 26.0, 48.0, 0)])
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,41 @@
+## Tests for StratumGraph's view of strata that are edited through their
+## ChunkIndex.
+
+import unittest
+
+from tests import DefinitionsTestCase
+from tony_json import Json
+from tony_stratum import StratumGraph
+
+class StratumGraphTest (DefinitionsTestCase):
+    def setUp (self):
+        DefinitionsTestCase.setUp (self)
+
+        self.write_stratum ('foundation', [], [('glib', [])])
+        self.write_stratum ('gnome', ['foundation'], [('gtk', [])])
+        self.graph = StratumGraph ()
+
+    def add_chunk (self, filename, name):
+        chunk_object = Json.Object ()
+        chunk_object.set_string_member ('name', name)
+        self.graph.get_chunk_index (filename).add_chunk (chunk_object)
+
+    def test_get_chunks_sees_added_chunks (self):
+        self.assertEqual (self.graph.get_chunks ('foundation.morph'), frozenset (['glib']))
+        self.add_chunk ('foundation.morph', 'zlib')
+        self.assertEqual (self.graph.get_chunks ('foundation.morph'),
+                          frozenset (['glib', 'zlib']))
+
+    def test_available_chunks_sees_added_chunks (self):
+        self.assertEqual (self.graph.get_available_chunks ('gnome.morph'), frozenset (['glib']))
+        self.add_chunk ('foundation.morph', 'zlib')
+        self.assertEqual (self.graph.get_available_chunks ('gnome.morph'),
+                          frozenset (['glib', 'zlib']))
+
+    def test_add_stratum (self):
+        self.graph.add_stratum ('foundation.morph', [], ['glib', 'zlib'])
+        self.assertEqual (self.graph.get_available_chunks ('gnome.morph'),
+                          frozenset (['glib', 'zlib']))
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,84 @@
+## Tests for the stratum rewriting helpers in tony.py.
+
+import json
+import unittest
+
+import tony
+from tony_edit import ChunkIndex
+from tony_json import Json
+
+def parse_stratum (chunks):
+    """
+    A stratum object with the given list of (name, build-depends) chunks.
+    """
+    parser = Json.Parser ()
+    parser.load_from_data (json.dumps ({
+        'name': 'test', 'kind': 'stratum',
+        'chunks': [{ 'name': name, 'repo': 'upstream:%s' % name, 'ref': 'master',
+                     'build-depends': build_depends }
+                   for (name, build_depends) in chunks] }))
+    return parser.get_root ().get_object ()
+
+def chunk_names (stratum):
+    return [c.get_object ().get_member ('name').get_string ()
+            for c in stratum.get_member ('chunks').get_array ().get_elements ()]
+
+class IndexedEditTest (unittest.TestCase):
+    def setUp (self):
+        self.stratum = parse_stratum ([('cairo', []), ('pango', ['cairo']), ('x', [])])
+        self.index = ChunkIndex (self.stratum)
+
+    def chunk_nodes (self):
+        return self.stratum.get_member ('chunks').get_array ().get_elements ()
+
+    def test_add_build_depends_to_all (self):
+        for node in self.chunk_nodes ():
+            tony.add_build_depends_to_all (node, 'x', self.index)
+
+        self.assertEqual (self.index.get_dependents ('x'), set (['cairo', 'pango']))
+        tony.sort_sources (self.stratum, self.index)
+        self.assertEqual (chunk_names (self.stratum), ['x', 'cairo', 'pango'])
+        self.assertEqual (self.index.names (), ['x', 'cairo', 'pango'])
+
+    def test_add_repo_and_sort_build_depends (self):
+        chunk_object = self.chunk_nodes ()[1].get_object ()
+        chunk_object.remove_member ('repo')
+        tony.add_repo (self.chunk_nodes ()[1], 'upstream:%s', self.index)
+        self.assertEqual (chunk_object.get_string_member ('repo'), 'upstream:pango')
+
+        tony.add_build_depends_to_all (self.chunk_nodes ()[1], 'a', self.index)
+        self.assertEqual (self.index.get_build_depends ('pango'), ['a', 'cairo'])
+        tony.sort_build_depends (chunk_object, self.index)
+        self.assertEqual (self.index.get_build_depends ('pango'), ['a', 'cairo'])
+
+class ReduceBuildDependsTest (unittest.TestCase):
+    def setUp (self):
+        self.stratum = parse_stratum ([
+            ('glib', []),
+            ('cairo', ['glib', 'x11']),
+            ('pango', ['glib', 'cairo']),
+            ('gtk', ['pango', 'x11', 'glib', 'cairo'])])
+        self.index = ChunkIndex (self.stratum)
+
+    def build_depends (self):
+        return dict ((c.get_object ().get_member ('name').get_string (),
+                      [bd.get_string () for bd in
+                       c.get_object ().get_array_member ('build-depends').get_elements ()])
+                     for c in self.stratum.get_member ('chunks').get_array ().get_elements ())
+
+    def test_all_chunks (self):
+        self.assertEqual (tony.reduce_build_depends (self.stratum, self.index), 3)
+        expected = { 'glib': [], 'cairo': ['glib', 'x11'], 'pango': ['cairo'],
+                     'gtk': ['pango', 'x11'] }
+        self.assertEqual (self.build_depends (), expected)
+        self.assertEqual (dict ((name, self.index.get_build_depends (name))
+                                for name in self.index.names ()), expected)
+        self.assertEqual (chunk_names (self.stratum), ['glib', 'cairo', 'pango', 'gtk'])
+
+    def test_named_chunks (self):
+        self.assertEqual (tony.reduce_build_depends (self.stratum, chunks = ['gtk']), 2)
+        self.assertEqual (self.build_depends ()['pango'], ['glib', 'cairo'])
+        self.assertEqual (self.build_depends ()['gtk'], ['pango', 'x11'])
+
+if __name__ == '__main__':
+    unittest.main ()
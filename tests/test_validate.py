@@ -0,0 +1,37 @@
+## Tests for validate.py, run against morphologies in a temporary directory.
+
+import unittest
+
+import validate
+from tests import DefinitionsTestCase
+
+class ValidateTest (DefinitionsTestCase):
+    def kinds (self, problems):
+        return sorted ((p['file'], p['kind']) for p in problems)
+
+    def test_build_dep_order_and_unknown (self):
+        self.write_stratum ('foundation', [], [('glib', [])])
+        self.write_stratum ('gnome', ['foundation'],
+                            [('gtk', ['glib', 'pango']), ('pango', ['glib']), ('app', ['nope'])])
+        self.assertEqual (self.kinds (validate.validate (['foundation.morph', 'gnome.morph'])),
+                          [('gnome.morph', 'build-dep-order'),
+                           ('gnome.morph', 'unknown-build-dep')])
+
+    def test_build_depends_on_broken_stratum (self):
+        f = open ('broken.morph', 'w')
+        f.write ('{ "name": ')
+        f.close ()
+        self.write_stratum ('gnome', ['broken'], [('gtk', [])])
+        self.assertEqual (self.kinds (validate.validate (['broken.morph', 'gnome.morph'])),
+                          [('broken.morph', 'parse-error')])
+
+    def test_stratum_cycle (self):
+        self.write_stratum ('a', ['b'], [('x', [])])
+        self.write_stratum ('b', ['a'], [('y', [])])
+        self.write_stratum ('c', ['a'], [('z', [])])
+        self.assertEqual (self.kinds (validate.validate (['a.morph', 'b.morph', 'c.morph'])),
+                          [('a.morph', 'stratum-cycle'), ('b.morph', 'stratum-cycle'),
+                           ('c.morph', 'stratum-cycle')])
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -1,16 +1,31 @@
 
-# Use JSON-GLib library instead of Python's Json module because representing
-# the data using Python data structures causes the ordering to be mostly lost.
-# JSON-GLib allows us to edit the data without reordering it.
+# Representing the data using plain Python data structures causes the
+# ordering to be mostly lost, so morphologies are edited through a JSON-GLib
+# style API that keeps it. See tony_json for the available backends.
 
-from gi.repository import Json
 import glob
-import re
+import hashlib
+import os
+import shutil
+import sys
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 from tony_fedora import FedoraPackageDB, fedora_ignore_list
-from tony_jhbuild import JhbuildModules
+from tony_graph import chunk_sort_key, topological_sort, transitive_reduction
+from tony_jhbuild import JHBUILD_CACHE_PATH, JhbuildModules
+from tony_edit import ChunkIndex, StratumEditor, edit_chunk, put_member_to_end
+from tony_json import Json, dump_morphology
+from tony_stratum import StratumGraph
+import tony_stats
 
 import json
 
+# Shared by everything in this run, so each stratum is only parsed once
+stratum_graph = StratumGraph()
+
+# Every morphology rewritten during this run, in the order they were written
+changed_files = []
+
 def get_repo_basename(repo):
     last_sep = max(repo.rfind(':'), repo.rfind('/'))
     if last_sep == -1:
@@ -20,14 +35,33 @@ def get_repo_basename(repo):
         return repo[last_sep+1:]
 
 def __main__ ():
+    # --stats [--profile DIR] is the same as setting TONY_STATS=1 and
+    # TONY_PROFILE_DIR=DIR, see tony_stats.
+    if '--stats' in sys.argv:
+        profile_dir = None
+        if '--profile' in sys.argv:
+            profile_dir = sys.argv[sys.argv.index('--profile') + 1]
+        tony_stats.enable (profile_dir)
+
+    # --reduce leaves out build-depends that are implied by other ones
+    reduce = '--reduce' in sys.argv
+
+    # --no-jhbuild-cache parses the modulesets even if they are cached
+    use_cache = '--no-jhbuild-cache' not in sys.argv
+
     # Synchronise with jhbuild moduleset
     jhbuild_import('/home/sam/gnome/src/jhbuild',
                    'gnome.morph',
-                   'meta-gnome-core-shell')
+                   'meta-gnome-core-shell',
+                   reduce, use_cache)
 
     jhbuild_import('/home/sam/gnome/src/jhbuild',
                    'gnome-legacy.morph',
-                   'meta-gnome-core-shell-fallback')
+                   'meta-gnome-core-shell-fallback',
+                   reduce, use_cache)
+
+    for filename in changed_files:
+        print "Changed: %s" % filename
 
 def convert_strata_list_to_use_triples(strata_list, repo, ref):
     builder = Json.Builder()
@@ -45,7 +79,8 @@ def convert_strata_list_to_use_triples(strata_list, repo, ref):
     return builder
 
 
-def jhbuild_import (jhbuild_path, stratum_morphology, target_metamodule):
+def jhbuild_import (jhbuild_path, stratum_morphology, target_metamodule,
+                    reduce = False, use_cache = True):
     inputs = [
         # apps & world - not needed for basic gnomeos
         'gnome-apps-3.6.modules',
@@ -107,27 +142,23 @@ def jhbuild_import (jhbuild_path, stratum_morphology, target_metamodule):
         'tracker'
     ])
 
-    (parser, stratum_build_depends) = load_stratum_with_deps(stratum_morphology)
-
-    jhbuild = JhbuildModules(jhbuild_path, inputs, ignore_list)
+    with tony_stats.phase('load-strata'):
+        (parser, stratum_build_depends) = load_stratum_with_deps(stratum_morphology)
 
-    chunk_dict = {}
+    with tony_stats.phase('jhbuild-parse'):
+        jhbuild = JhbuildModules(jhbuild_path, inputs, ignore_list, parallel = True,
+                                 cache_path = JHBUILD_CACHE_PATH if use_cache else None)
 
-    chunks = jhbuild.get_module_list(target_metamodule)
+    with tony_stats.phase('jhbuild-closure'):
+        chunks = jhbuild.get_module_list(target_metamodule)
     jhbuild_chunks = chunks.difference(stratum_build_depends)
 
-    source_list = parser.get_root().get_object().get_member('chunks')
-
-    morph_chunks = set()
-    for chunk_node in source_list.get_array().get_elements():
-        chunk_object = chunk_node.get_object ()
-        chunk_name = chunk_object.get_member('name').get_string()
-        chunk_dict[chunk_name] = chunk_object
-
-        morph_chunks.add (chunk_name)
+    index = stratum_graph.get_chunk_index(stratum_morphology)
 
+    for chunk_name in index.names():
         if not jhbuild.chunk_is_module (chunk_name):
             continue
+        chunk_object = index.get (chunk_name)
 
         if False:
             # Check dependencies match jhbuild
@@ -140,8 +171,10 @@ def jhbuild_import (jhbuild_path, stratum_morphology, target_metamodule):
                 new_build_depends.add_string_element (bd)
 
             chunk_object.set_array_member ('build-depends', new_build_depends)
+            index.update_chunk (chunk_name)
 
-    for new_chunk in jhbuild_chunks.difference(morph_chunks):
+    new_chunks = sorted(jhbuild_chunks.difference(index.chunks))
+    for new_chunk in new_chunks:
         chunk_object = Json.Object ()
         chunk_object.set_string_member ('name', new_chunk)
 
@@ -163,207 +196,170 @@ def jhbuild_import (jhbuild_path, stratum_morphology, target_metamodule):
             new_build_depends.add_string_element (bd)
 
         chunk_object.set_array_member ('build-depends', new_build_depends)
-        source_list.get_array().add_object_element (chunk_object)
+        index.add_chunk (chunk_object)
 
-    sort_sources (parser.get_root().get_object())
+    if reduce:
+        with tony_stats.phase('reduce'):
+            removed = reduce_build_depends (parser.get_root().get_object(), index, new_chunks)
+        print "%s: removed %i redundant build-depends" % (stratum_morphology, removed)
 
-    write_json_postprocessed (stratum_morphology, parser.get_root())
+    with tony_stats.phase('sort'):
+        sort_sources (parser.get_root().get_object(), index)
 
+    with tony_stats.phase('write'):
+        write_json_postprocessed (stratum_morphology, parser.get_root())
 
-def add_repo (source_node, repo_format):
+
+def edit_indexed_chunk (chunk_object, index = None, **edits):
     """
-    Add a "repo" key, using repo_format % chunk_name
+    edit_chunk(), then update 'index', the stratum's ChunkIndex, if given
+    and anything changed.
     """
-    source_object = source_node.get_object ()
-    source_name = source_object.get_member('name').get_string()
+    changed = edit_chunk (chunk_object, **edits)
+    if changed and index is not None:
+        index.update_chunk (chunk_object.get_member ('name').get_string ())
+    return changed
 
-    if not source_object.has_member('repo'):
-        source_object.set_string_member ('repo', repo_format % source_name)
 
-        # Hack to fix the ordering ...
-
-        if source_object.has_member('ref'):
-            bd = source_object.get_member ('ref').copy ()
-            source_object.remove_member ('ref')
-            source_object.set_member ('ref', bd)
-
-        if source_object.has_member('build-depends'):
-            bd = source_object.get_member ('build-depends').copy ()
-            source_object.remove_member ('build-depends')
-            source_object.set_member ('build-depends', bd)
+def add_repo (source_node, repo_format, index = None):
+    """
+    Add a "repo" key, using repo_format % chunk_name
+    """
+    edit_indexed_chunk (source_node.get_object (), index, default_repo = repo_format)
 
 
-def add_build_depends_to_all (source_node, build_dep_name):
+def add_build_depends_to_all (source_node, build_dep_name, index = None):
     """
     Add a chunk to "build-depends" for each source in a stratum
     """
-    source_object = source_node.get_object ()
-
-    if source_object.get_member('name').get_string() == build_dep_name:
-        return
-
-    # This is the method so the build-depends list remains sorted
-    old_build_depends_node = source_object.get_member ("build-depends")
-    new_build_depends = Json.Array()
-
-    build_depends = []
-
-    for bd in old_build_depends_node.get_array().get_elements():
-        build_depends.append (bd.get_string())
-    build_depends.append (build_dep_name)
+    # The build-depends list remains sorted
+    edit_indexed_chunk (source_node.get_object (), index,
+                        add_build_depends = [build_dep_name])
 
-    build_depends.sort()
 
-    for bd in build_depends:
-        new_build_depends.add_string_element (bd)
-
-    source_object.set_array_member ('build-depends', new_build_depends)
-
-
-def add_build_depends_from_fedora (chunk_dict, source_list):
+def add_build_depends_from_fedora (index, repo_index = None, jobs = 1):
     """
-    Work out "build-depends" from Fedora spec files
+    Work out "build-depends" from Fedora spec files for each chunk in the
+    ChunkIndex 'index', and keep the index up to date. Pass a FedoraRepoIndex
+    to avoid querying Yum. With jobs > 1 the chunks are looked up in that
+    many threads, each checking packages, downloading specs and running
+    repoquery for its own chunks; the results are applied in the original
+    order either way.
     """
-    fedora = FedoraPackageDB ('/home/sam/baserock/spec-cache', chunk_dict)
-
-    for chunk_node in source_list.get_array().get_elements():
-        chunk_object = chunk_node.get_object ()
-        chunk_name = chunk_object.get_member('name').get_string()
-
-        if chunk_name in fedora_ignore_list or chunk_name.startswith("xorg-proto-"):
-            # These are all just xorg-x11-proto-devel in Fedora
-            continue
-
-        fedora_build_depends = fedora.get_build_depends (chunk_name)
+    all_chunk_names = index.names ()
+
+    # These are all just xorg-x11-proto-devel in Fedora
+    chunk_names = [chunk_name for chunk_name in all_chunk_names
+                   if chunk_name not in fedora_ignore_list and
+                      not chunk_name.startswith ("xorg-proto-")]
+
+    with tony_stats.phase ('fedora-db'):
+        # Built lazily when there are workers, so that the slow part happens
+        # in them rather than up front in this thread
+        fedora = FedoraPackageDB ('/home/sam/baserock/spec-cache', all_chunk_names,
+                                  repo_index, lazy = jobs > 1)
+
+    with tony_stats.phase ('fedora-build-depends'):
+        if jobs > 1:
+            pool = ThreadPool (jobs)
+            try:
+                all_build_depends = pool.map (fedora.get_build_depends, chunk_names)
+            finally:
+                pool.close ()
+                pool.join ()
+        else:
+            all_build_depends = [fedora.get_build_depends (c) for c in chunk_names]
 
+    for (chunk_name, fedora_build_depends) in zip (chunk_names, all_build_depends):
         fedora_build_depends.sort()
 
         new_build_depends = Json.Array()
         for bd in fedora_build_depends:
             new_build_depends.add_string_element (bd)
 
-        chunk_object.set_array_member ('build-depends', new_build_depends)
-
-
-def sort_build_depends (chunk_object):
-    old_build_depends_node = chunk_object.get_member ("build-depends")
-    new_build_depends = Json.Array()
-
-    build_depends = []
-
-    for bd in old_build_depends_node.get_array().get_elements():
-        build_depends.append (bd.get_string())
-
-    build_depends.sort()
+        index.get (chunk_name).set_array_member ('build-depends', new_build_depends)
+        index.update_chunk (chunk_name)
 
-    for bd in build_depends:
-        new_build_depends.add_string_element (bd)
 
-    chunk_object.set_array_member ('build-depends', new_build_depends)
+def sort_build_depends (chunk_object, index = None):
+    edit_indexed_chunk (chunk_object, index, sort_build_depends = True)
 
-def sort_sources (stratum_object):
-    source_list = stratum_object.get_member('chunks')
-
-    source_nodes = source_list.get_array().get_elements()
-
-    source_dict = {}
-    for node in source_nodes:
-        name_node = node.get_object().get_member('name')
-        source_dict[name_node.get_string()] = node
-    sort_order = list(source_dict.keys())
-    sort_order.sort(key=str.lower)
+def sort_sources (stratum_object, index = None):
+    """
+    Sort chunks alphabetically, except where they need to come after their
+    build-depends. Raises DependencyCycleError naming the chunks involved if
+    there is no valid order. If 'index' is the stratum's ChunkIndex, it is
+    used and kept up to date.
+    """
+    if index is None:
+        index = ChunkIndex(stratum_object)
 
-    sorted_nodes = []
-    satisfied_list = []
+    source_deps = index.build_depends
 
-    # Simple try-try-again algorithm to satisfy dependency ordering too
-    repeat_count = 0
-    while len (sort_order) > 0 and repeat_count < 10:
-        postponed_list = []
+    for name in sorted(source_deps, key=chunk_sort_key):
+        for d in source_deps[name]:
+            if d not in index:
+                print "Warning: %s: unknown build-dep %s" % (name, d)
 
-        for source_name in sort_order:
-            deps_satisfied = True
+    tony_stats.count('sorts')
+    tony_stats.count('graph-nodes', len(source_deps))
+    tony_stats.count('graph-edges', sum(len(d) for d in source_deps.values()))
 
-            source_node = source_dict[source_name]
-            build_depends_node = source_node.get_object().get_member('build-depends')
-            for d in build_depends_node.get_array().get_elements():
-                if d.get_string() not in satisfied_list:
-                    deps_satisfied = False
-                    break
+    order = topological_sort(source_deps)
+    new_source_list = Json.Array()
+    for name in order:
+        new_source_list.add_object_element (index.get(name))
 
-            if deps_satisfied:
-                sorted_nodes.append (source_node)
-                satisfied_list.append (source_name)
-            else:
-                postponed_list.append (source_name)
+    stratum_object.set_array_member ('chunks', new_source_list)
+    index.reorder (order)
 
-        if len(postponed_list) == len(sort_order):
-            # We're probably stuck
-            repeat_count += 1
+def reduce_build_depends (stratum_object, index = None, chunks = None):
+    """
+    Remove build-depends that a chunk gets anyway through its other
+    build-depends, from every chunk or only from those named in 'chunks'. The
+    order of what remains is unchanged. Returns the number removed.
+    """
+    if index is None:
+        index = ChunkIndex(stratum_object)
 
-        sort_order = postponed_list
+    reduced = transitive_reduction(index.build_depends)
 
-    new_source_list = Json.Array()
-    for node in sorted_nodes:
-        new_source_list.add_object_element (node.get_object())
+    editor = StratumEditor(stratum_object, index)
+    removed = 0
+    for name in (index.names() if chunks is None else chunks):
+        kept = set(reduced[name])
+        for d in index.get_build_depends(name):
+            if d not in kept:
+                editor.remove_build_depend (d, [name])
+                removed += 1
+    editor.apply()
 
-    stratum_object.set_array_member ('chunks', new_source_list)
+    tony_stats.count('build-depends-removed', removed)
+    return removed
 
-def fix_stratum_sorting (stratum):
+def fix_stratum_sorting (stratum, index = None):
     if stratum.get_member('kind').get_string() != 'stratum' or \
        stratum.get_member('chunks') == None:
         return
 
-    for sources_node in stratum.get_member('chunks').get_array().get_elements():
-        sources = sources_node.get_object()
-        build_depends = sources.get_array_member('build-depends').copy()
-        sources.remove_member('build-depends')
-        sources.set_array_member('build-depends', build_depends)
+    StratumEditor(stratum, index).move_to_end(['build-depends']).apply()
 
 def load_stratum_with_deps(filename, nested = False):
     '''Returns: tuplet of Json.Parser for current file, and set of chunks
     that are available in strata that this one depends on.
     '''
 
-    parser = Json.Parser()
-    parser.load_from_file(filename)
+    parser = stratum_graph.get_parser(filename)
 
-    build_dep_chunk_set = set()
+    build_dep_chunk_set = set(stratum_graph.get_available_chunks(filename))
 
-    build_dep_list = parser.get_root().get_object().get_member('build-depends')
-    if build_dep_list is not None:
-        build_dep_list = [
-            node.get_object().get_member("morph").get_string()+".morph"
-            for node in build_dep_list.get_array().get_elements()]
-    else:
-        build_dep_list = []
     if not nested:
-        build_dep_list += ['devel.morph', 'foundation.morph']
-
-    for child_filename in build_dep_list:
-        # FIXME: use a more geological term for "the stratum below this one" :)
-        (child_parser, child_build_dep_set) = load_stratum_with_deps(child_filename, nested = True)
-
-        build_dep_chunk_set = set.union(build_dep_chunk_set, child_build_dep_set)
-
-        child_stratum = child_parser.get_root().get_object()
-        child_source_list = child_stratum.get_member('chunks')
-
-        for chunk_node in child_source_list.get_array().get_elements():
-            chunk_object = chunk_node.get_object ()
-            chunk_name = chunk_object.get_member('name').get_string()
-
-            build_dep_chunk_set.add (chunk_name)
+        for child_filename in ['devel.morph', 'foundation.morph']:
+            build_dep_chunk_set.update(stratum_graph.get_chunks(child_filename))
+            build_dep_chunk_set.update(stratum_graph.get_available_chunks(child_filename))
 
     return (parser, build_dep_chunk_set)
 
-def put_member_to_end(struct, name):
-    value = struct.get_member(name)
-    if value is not None:
-        value = value.copy()
-        struct.remove_member(name)
-        struct.set_member(name, value)
-
 def rename_member(struct, old_name, new_name):
     member = struct.get_member(old_name)
 
@@ -374,28 +370,44 @@ def rename_member(struct, old_name, new_name):
 def write_json_postprocessed (filename, root_node):
     """
     JSON-GLib's output is *almost* perfect ... but for some reason there's a
-    space after dict keys and no way to turn it off. So we post-process its
-    output before writing it to a file.
+    space after dict keys and no way to turn it off. So instead of using its
+    generator we write Baserock's formatting directly.
+
+    The file is only rewritten if its contents would change, and then by
+    renaming a temporary file over it so it is never left half-written.
+    Returns True if the file changed.
     """
 
-    generator = Json.Generator ()
-    generator.set_indent (4)
-    generator.set_pretty (True)
+    buf = StringIO ()
+    dump_morphology (buf, root_node)
+    output = buf.getvalue ()
 
-    generator.set_root (root_node)
+    if os.path.exists (filename):
+        f = open (filename)
+        old_hash = hashlib.sha1 (f.read ()).hexdigest ()
+        f.close ()
 
-    output = generator.to_data ()[0]
+        if old_hash == hashlib.sha1 (output).hexdigest ():
+            tony_stats.count ('files-unchanged')
+            return False
 
-    # Remove space after object properties
-    output = re.sub ('(\s+"[A-Za-z0-9-_]+") : ', '\\1: ', output)
+    temp_filename = os.path.join (os.path.dirname (filename) or '.',
+                                  '.%s.tmp' % os.path.basename (filename))
+    f = open (temp_filename, "w")
+    f.write (output)
+    f.close ()
 
-    # Put empty arrays on single line
-    output = re.sub (': \[\s+\]', ': []', output)
+    if os.path.exists (filename):
+        shutil.copymode (filename, temp_filename)
+    os.rename (temp_filename, filename)
 
-    f = open (filename, "w")
-    f.write (output + "\n")
-    f.close ()
+    tony_stats.count ('files-written')
+    tony_stats.count ('bytes-written', len (output))
+
+    changed_files.append (filename)
+    return True
 
 
-__main__ ()
+if __name__ == '__main__':
+    __main__ ()
 
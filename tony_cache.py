@@ -0,0 +1,65 @@
+## On-disk caches of JSON data, one file per entry, as used for parsed jhbuild
+## modulesets and for impact.py's definitions graph.
+##
+## Entries are written to a temporary file and renamed into place, so a reader
+## never sees half of one. Callers put whatever identifies the format into the
+## filename or the data, and check it themselves after load().
+
+import json
+import os
+import sys
+import threading
+
+
+def load(cache_file):
+    '''Returns the data saved in 'cache_file', or None if there is none or it
+    can't be read. Marks the entry as recently used.
+    '''
+    try:
+        f = open(cache_file)
+    except IOError:
+        return None
+
+    try:
+        data = json.load(f)
+    except ValueError:
+        sys.stderr.write("Warning: ignoring corrupt cache %s\n" % cache_file)
+        return None
+    finally:
+        f.close()
+
+    # Mark as recently used, for eviction
+    try:
+        os.utime(cache_file, None)
+    except OSError:
+        # Evicted by someone else since we read it
+        pass
+    return data
+
+
+def save(cache_file, data, max_entries=None):
+    '''Write 'data' to 'cache_file'. If 'max_entries' is given, then remove
+    the least recently used entries in the same directory beyond that many.
+    '''
+    cache_path = os.path.dirname(cache_file)
+    if not os.path.exists(cache_path):
+        try:
+            os.makedirs(cache_path)
+        except OSError:
+            # Another thread or process got there first
+            pass
+
+    # Named per thread, as several may be saving the same entry at once
+    temp_file = '%s.%i.%i.tmp' % (cache_file, os.getpid(),
+                                  threading.current_thread().ident)
+    f = open(temp_file, 'w')
+    json.dump(data, f, separators=(',', ':'))
+    f.close()
+    os.rename(temp_file, cache_file)
+
+    if max_entries is not None:
+        entries = [os.path.join(cache_path, e) for e in os.listdir(cache_path)
+                   if e.endswith('.json')]
+        entries.sort(key=lambda e: os.stat(e).st_mtime, reverse=True)
+        for stale in entries[max_entries:]:
+            os.remove(stale)
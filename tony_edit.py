@@ -0,0 +1,283 @@
+## Look up and edit the chunks of a stratum.
+##
+## ChunkIndex finds chunks by name, and which chunks build-depend on a chunk,
+## without scanning the stratum. StratumEditor applies many edits in one
+## pass: each chunk's "build-depends" array is read once and, if anything
+## changed, replaced once, however many edits touch it.
+
+from tony_json import Json
+
+def put_member_to_end(struct, name):
+    value = struct.get_member(name)
+    if value is not None:
+        value = value.copy()
+        struct.remove_member(name)
+        struct.set_member(name, value)
+
+def get_build_depends(chunk_object):
+    node = chunk_object.get_member('build-depends')
+    if node is None:
+        return []
+    return [bd.get_string() for bd in node.get_array().get_elements()]
+
+def edit_chunk(chunk_object, add_build_depends=(), remove_build_depends=(),
+               sort_build_depends=False, repo=None, ref=None,
+               default_repo=None, move_to_end=()):
+    '''Apply a set of edits to one chunk. Returns True if anything changed.
+
+    Adding build-depends keeps the list sorted; a chunk never gets itself as
+    a build-dep. 'default_repo' is a format string taking the chunk name,
+    used only if the chunk has no repo yet. Keys in 'move_to_end' are moved to
+    the end of the chunk, in that order. A "repo" or "ref" that the chunk
+    didn't have is put before "ref" and "build-depends", as Baserock writes
+    them.
+    '''
+    name = chunk_object.get_member('name').get_string()
+    changed = False
+    move_to_end = list(move_to_end)
+
+    if default_repo is not None and repo is None and \
+       not chunk_object.has_member('repo'):
+        repo = default_repo % name
+
+    if (repo is not None and not chunk_object.has_member('repo')) or \
+       (ref is not None and not chunk_object.has_member('ref')):
+        # New keys go at the end, so put these back after them
+        move_to_end = [k for k in move_to_end if k not in ['ref', 'build-depends']] + \
+                      ['ref', 'build-depends']
+
+    if repo is not None and (not chunk_object.has_member('repo') or
+                             chunk_object.get_member('repo').get_string() != repo):
+        chunk_object.set_string_member('repo', repo)
+        changed = True
+
+    if ref is not None and (not chunk_object.has_member('ref') or
+                            chunk_object.get_member('ref').get_string() != ref):
+        chunk_object.set_string_member('ref', ref)
+        changed = True
+
+    new_build_depends = None
+    if add_build_depends or remove_build_depends or sort_build_depends:
+        old_build_depends = get_build_depends(chunk_object)
+
+        remove = set(remove_build_depends)
+        build_depends = [bd for bd in old_build_depends if bd not in remove]
+        present = set(build_depends)
+        added = False
+        for bd in add_build_depends:
+            if bd != name and bd not in present:
+                build_depends.append(bd)
+                present.add(bd)
+                added = True
+
+        if sort_build_depends or added:
+            build_depends.sort()
+
+        if build_depends != old_build_depends or \
+           not chunk_object.has_member('build-depends'):
+            new_build_depends = Json.Array()
+            for bd in build_depends:
+                new_build_depends.add_string_element(bd)
+
+    for key in move_to_end:
+        if key == 'build-depends' and new_build_depends is not None:
+            if chunk_object.has_member(key):
+                chunk_object.remove_member(key)
+            chunk_object.set_array_member(key, new_build_depends)
+            new_build_depends = None
+            changed = True
+        elif chunk_object.has_member(key):
+            put_member_to_end(chunk_object, key)
+            changed = True
+
+    if new_build_depends is not None:
+        chunk_object.set_array_member('build-depends', new_build_depends)
+        changed = True
+
+    return changed
+
+
+class ChunkIndex():
+    '''Indexes of the chunks in a stratum: by name, by position, and from each
+    chunk to the chunks that build-depend on it. Call update_chunk() after
+    changing a chunk's build-depends some other way than through a
+    StratumEditor that was given this index. 'on_add' is called with the
+    name of each chunk passed to add_chunk().
+    '''
+
+    def __init__(self, stratum_object, on_add=None):
+        self.stratum = stratum_object
+        self.on_add = on_add
+        self.rebuild()
+
+    def rebuild(self):
+        # Chunk name -> Json.Object
+        self.chunks = {}
+        # Chunk names in stratum order, and name -> position in that list
+        self.order = []
+        self.positions = {}
+        # Chunk name -> list of its build-depends
+        self.build_depends = {}
+        # Chunk name -> set of names of chunks that build-depend on it
+        self.dependents = {}
+
+        chunks_node = self.stratum.get_member('chunks')
+        if chunks_node is None:
+            return
+        for chunk_node in chunks_node.get_array().get_elements():
+            self._add(chunk_node.get_object())
+
+    def _add(self, chunk_object):
+        name = chunk_object.get_member('name').get_string()
+        self.chunks[name] = chunk_object
+        self.positions[name] = len(self.order)
+        self.order.append(name)
+        self.build_depends[name] = []
+        self._set_build_depends(name, get_build_depends(chunk_object))
+
+    def _set_build_depends(self, name, build_depends):
+        for bd in self.build_depends[name]:
+            self.dependents[bd].discard(name)
+        self.build_depends[name] = build_depends
+        for bd in build_depends:
+            self.dependents.setdefault(bd, set()).add(name)
+
+    def __contains__(self, name):
+        return name in self.chunks
+
+    def __len__(self):
+        return len(self.order)
+
+    def names(self):
+        '''Chunk names, in stratum order'''
+        return list(self.order)
+
+    def get(self, name):
+        return self.chunks.get(name)
+
+    def position(self, name):
+        return self.positions.get(name)
+
+    def get_build_depends(self, name):
+        return self.build_depends.get(name, [])
+
+    def get_dependents(self, name):
+        '''Names of the chunks in this stratum that build-depend on 'name' '''
+        return self.dependents.get(name, set())
+
+    def add_chunk(self, chunk_object):
+        '''Append a new chunk to the stratum'''
+        self.stratum.get_member('chunks').get_array().add_object_element(chunk_object)
+        self._add(chunk_object)
+        if self.on_add is not None:
+            self.on_add(chunk_object.get_member('name').get_string())
+
+    def update_chunk(self, name):
+        '''Re-read the build-depends of chunk 'name' '''
+        self._set_build_depends(name, get_build_depends(self.chunks[name]))
+
+    def reorder(self, names):
+        '''Record that the stratum's chunks are now in the order 'names' '''
+        self.order = list(names)
+        self.positions = dict((name, i) for (i, name) in enumerate(self.order))
+
+
+class StratumEditor():
+    '''Queue edits to the chunks of a stratum, then apply() them all in one
+    pass. Methods that take 'chunks' apply to every chunk when it is None,
+    otherwise to the named chunks.
+    '''
+
+    def __init__(self, stratum_object, index=None):
+        self.stratum = stratum_object
+        # If given, kept up to date, and used to find the chunks when only
+        # specific chunks are being edited.
+        self.index = index
+        # Edits for every chunk, and chunk name -> edits for that chunk;
+        # each is a dict of edit_chunk() keyword arguments.
+        self.all_edits = self._new_edits()
+        self.chunk_edits = {}
+
+    def _new_edits(self):
+        return {'add_build_depends': [], 'remove_build_depends': [],
+                'sort_build_depends': False, 'move_to_end': []}
+
+    def _edits_for(self, chunks):
+        if chunks is None:
+            return [self.all_edits]
+        return [self.chunk_edits.setdefault(c, self._new_edits()) for c in chunks]
+
+    def add_build_depend(self, build_dep, chunks=None):
+        for edits in self._edits_for(chunks):
+            edits['add_build_depends'].append(build_dep)
+        return self
+
+    def remove_build_depend(self, build_dep, chunks=None):
+        for edits in self._edits_for(chunks):
+            edits['remove_build_depends'].append(build_dep)
+        return self
+
+    def sort_build_depends(self, chunks=None):
+        for edits in self._edits_for(chunks):
+            edits['sort_build_depends'] = True
+        return self
+
+    def move_to_end(self, keys, chunks=None):
+        for edits in self._edits_for(chunks):
+            edits['move_to_end'].extend(keys)
+        return self
+
+    def set_repo(self, chunk, repo, ref=None):
+        edits = self._edits_for([chunk])[0]
+        edits['repo'] = repo
+        if ref is not None:
+            edits['ref'] = ref
+        return self
+
+    def set_default_repo(self, repo_format, chunks=None):
+        '''Give chunks with no repo one of repo_format % chunk_name'''
+        for edits in self._edits_for(chunks):
+            edits['default_repo'] = repo_format
+        return self
+
+    def _merged_edits(self, name):
+        edits = dict(self.all_edits)
+        specific = self.chunk_edits.get(name)
+        if specific is not None:
+            for key, value in specific.items():
+                if isinstance(value, list):
+                    edits[key] = edits[key] + value
+                elif key == 'sort_build_depends':
+                    edits[key] = edits[key] or value
+                else:
+                    edits[key] = value
+        return edits
+
+    def apply(self):
+        '''Apply every queued edit and forget them. Returns the list of names
+        of chunks that changed.
+        '''
+        changed = []
+
+        if self.index is not None and self.all_edits == self._new_edits():
+            targets = [(name, self.index.get(name))
+                       for name in sorted(self.chunk_edits, key=self.index.position)
+                       if name in self.index]
+        else:
+            targets = []
+            chunks_node = self.stratum.get_member('chunks')
+            if chunks_node is not None:
+                for chunk_node in chunks_node.get_array().get_elements():
+                    chunk_object = chunk_node.get_object()
+                    targets.append((chunk_object.get_member('name').get_string(),
+                                    chunk_object))
+
+        for (name, chunk_object) in targets:
+            if edit_chunk(chunk_object, **self._merged_edits(name)):
+                changed.append(name)
+                if self.index is not None:
+                    self.index.update_chunk(name)
+
+        self.all_edits = self._new_edits()
+        self.chunk_edits = {}
+        return changed
@@ -1,11 +1,27 @@
 ## Process Fedora spec files to get a set of build-depends.
 ##
-## Currently uses Yum to test validity and whatprovides, so needs to be run on
-## a Fedora system although the packages do not actually need to be installed.
-
+## By default uses Yum to test validity and whatprovides, so needs to be run
+## on a Fedora system although the packages do not actually need to be
+## installed. Alternatively, pass a FedoraRepoIndex built from a copy of the
+## repository metadata and no subprocesses are needed.
+
+import email.utils
+import gzip
+import hashlib
+import httplib
+import json
 import os
 import re
+import sqlite3
 import subprocess
+import threading
+import time
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+import tony_cache
+import tony_stats
+import xml.etree.cElementTree as ElementTree
 
 ## Chunks that don't map sensibly onto Fedora packages and will have to be
 ## dealt with by hand.
@@ -52,15 +68,37 @@ build_dep_ignore_list = [
 ]
 
 def check_package_exists (name):
+    tony_stats.count ('subprocesses')
     output = subprocess.check_output ('repoquery -C %s' % name, shell = True)
 
     if len(output) > 0:
         return True
     return False
 
+## Maximum number of names passed to a single repoquery process
+##
+REPOQUERY_BATCH_SIZE = 200
+
+def check_packages_exist (names):
+    """
+    Returns the set of package names from 'names' that exist, using as few
+    repoquery processes as possible.
+    """
+    names = sorted (set (names))
+    present = set ()
+
+    for i in range (0, len (names), REPOQUERY_BATCH_SIZE):
+        batch = names[i:i + REPOQUERY_BATCH_SIZE]
+        tony_stats.count ('subprocesses')
+        output = subprocess.check_output (['repoquery', '-C', '--qf', '%{NAME}'] + batch)
+        present.update (output.split ())
+
+    return present.intersection (names)
+
 def get_fedora_package_for_build_requires (owner, fedora_build_requires):
     yum_query = 'repoquery -C --whatprovides "%s" --qf "%%{NAME}\\n"'
 
+    tony_stats.count ('subprocesses')
     try:
         output = subprocess.check_output (yum_query % fedora_build_requires, shell = True)
     except subprocess.CalledProcessError as e:
@@ -68,12 +106,417 @@ def get_fedora_package_for_build_requires (owner, fedora_build_requires):
         return None
 
     candidate_list = output.split()
-    if candidate_list is None:
+    if len (candidate_list) == 0:
         print "Warning: %s: nothing provides %s" % (owner, fedora_build_requires)
         return None
 
     return candidate_list[0]
 
+class FedoraRepoIndex ():
+    """
+    Package name and provides indexes built from a local copy of a Fedora
+    repository's primary metadata, either 'primary.xml[.gz]' or
+    'primary.sqlite'.
+    """
+
+    COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+    RPM_NS = '{http://linux.duke.edu/metadata/rpm}'
+
+    def __init__ (self, primary_path):
+        self.packages = set ()
+        # Capability or file name -> set of package names providing it
+        self.provides = {}
+
+        if primary_path.endswith ('.sqlite'):
+            self._load_sqlite (primary_path)
+        else:
+            self._load_xml (primary_path)
+
+    def _add_provide (self, capability, package_name):
+        self.provides.setdefault (capability, set ()).add (package_name)
+
+    def _load_xml (self, primary_path):
+        if primary_path.endswith ('.gz'):
+            f = gzip.open (primary_path)
+        else:
+            f = open (primary_path)
+
+        package_tag = self.COMMON_NS + 'package'
+        name_tag = self.COMMON_NS + 'name'
+        arch_tag = self.COMMON_NS + 'arch'
+        file_tag = self.COMMON_NS + 'file'
+        entry_tag = self.RPM_NS + 'entry'
+        provides_tag = self.RPM_NS + 'provides'
+
+        events = ElementTree.iterparse (f, events = ('start', 'end'))
+        (event, root) = next (events)
+
+        for (event, element) in events:
+            if event != 'end' or element.tag != package_tag:
+                continue
+
+            if element.findtext (arch_tag) != 'src':
+                name = element.findtext (name_tag)
+                self.packages.add (name)
+
+                for provides in element.iter (provides_tag):
+                    for entry in provides.iter (entry_tag):
+                        self._add_provide (entry.get ('name'), name)
+                for file_element in element.iter (file_tag):
+                    self._add_provide (file_element.text, name)
+
+            # Packages are children of the root, so clearing just the package
+            # would still leave an empty element behind for every one
+            root.clear ()
+
+        f.close ()
+
+    def _load_sqlite (self, primary_path):
+        db = sqlite3.connect (primary_path)
+
+        for (name,) in db.execute ("SELECT name FROM packages WHERE arch != 'src'"):
+            self.packages.add (name)
+
+        for table in ['provides', 'files']:
+            query = ("SELECT %s.name, packages.name FROM %s JOIN packages "
+                     "USING (pkgKey) WHERE packages.arch != 'src'" % (table, table))
+            for (capability, name) in db.execute (query):
+                self._add_provide (capability, name)
+
+        db.close ()
+
+    def packages_exist (self, names):
+        return self.packages.intersection (names)
+
+    def whatprovides (self, owner, fedora_build_requires):
+        candidate_list = sorted (self.provides.get (fedora_build_requires, ()))
+        if len (candidate_list) == 0:
+            print "Warning: %s: nothing provides %s" % (owner, fedora_build_requires)
+            return None
+
+        return candidate_list[0]
+
+## Spec files are fetched over at most this many connections at once, and
+## each one is tried this many times before giving up.
+##
+SPEC_FETCH_CONNECTIONS = 8
+SPEC_FETCH_ATTEMPTS = 3
+
+class SpecFetcher ():
+    """
+    Downloads files concurrently, reusing one HTTP connection per host in each
+    worker thread. Files that are already present are revalidated with a
+    conditional request rather than downloaded again; the ETag and
+    Last-Modified headers are kept alongside each file in '<file>.headers'.
+    """
+
+    def __init__ (self, connections = SPEC_FETCH_CONNECTIONS,
+                  attempts = SPEC_FETCH_ATTEMPTS):
+        self.connections = connections
+        self.attempts = attempts
+        self.local = threading.local ()
+
+    def _get_connection (self, scheme, host):
+        if not hasattr (self.local, 'connections'):
+            self.local.connections = {}
+
+        key = (scheme, host)
+        if key not in self.local.connections:
+            if scheme == 'https':
+                self.local.connections[key] = httplib.HTTPSConnection (host, timeout = 60)
+            else:
+                self.local.connections[key] = httplib.HTTPConnection (host, timeout = 60)
+        return self.local.connections[key]
+
+    def _drop_connection (self, scheme, host):
+        connection = self.local.connections.pop ((scheme, host), None)
+        if connection is not None:
+            connection.close ()
+
+    def _load_validators (self, filename):
+        if not os.path.exists (filename) or os.stat (filename).st_size == 0:
+            return {}
+
+        try:
+            f = open (filename + '.headers')
+            try:
+                return json.load (f)
+            finally:
+                f.close ()
+        except (IOError, ValueError):
+            # Fall back to the file's own timestamp
+            return { 'Last-Modified': email.utils.formatdate (
+                        os.stat (filename).st_mtime, usegmt = True) }
+
+    def _request (self, url, headers):
+        """
+        Returns (status, response headers, body), following redirects.
+        """
+        for redirect in range (5):
+            parts = urlparse.urlsplit (url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            connection = self._get_connection (parts.scheme, parts.netloc)
+            tony_stats.count ('http-requests')
+            try:
+                connection.request ('GET', path, headers = headers)
+                response = connection.getresponse ()
+                body = response.read ()
+            except (httplib.HTTPException, IOError):
+                self._drop_connection (parts.scheme, parts.netloc)
+                raise
+
+            if response.status in (301, 302, 303, 307) and response.getheader ('location'):
+                url = urlparse.urljoin (url, response.getheader ('location'))
+                continue
+
+            return (response.status, response, body)
+
+        raise IOError ("Too many redirects for %s" % url)
+
+    def fetch (self, url, filename):
+        """
+        Make sure 'filename' is an up to date copy of 'url'. Returns True if
+        it is, False if it could not be fetched.
+        """
+        validators = self._load_validators (filename)
+
+        headers = {}
+        if 'ETag' in validators:
+            headers['If-None-Match'] = validators['ETag']
+        if 'Last-Modified' in validators:
+            headers['If-Modified-Since'] = validators['Last-Modified']
+
+        error = None
+        for attempt in range (self.attempts):
+            try:
+                (status, response, body) = self._request (url, headers)
+            except (httplib.HTTPException, IOError) as e:
+                error = str (e)
+                time.sleep (attempt)
+                continue
+
+            if status == 304:
+                return True
+
+            if status != 200:
+                error = "HTTP status %i" % status
+                if status < 500:
+                    break
+                time.sleep (attempt)
+                continue
+
+            length = response.getheader ('content-length')
+            if length is not None and int (length) != len (body):
+                error = "truncated download"
+                continue
+
+            tony_stats.count ('bytes-downloaded', len (body))
+
+            # Write atomically so an interrupted run never leaves a partial spec
+            temp_filename = filename + '.tmp'
+            f = open (temp_filename, 'w')
+            f.write (body)
+            f.close ()
+            os.rename (temp_filename, filename)
+
+            new_validators = {}
+            for header in ['ETag', 'Last-Modified']:
+                if response.getheader (header):
+                    new_validators[header] = response.getheader (header)
+            f = open (filename + '.headers', 'w')
+            json.dump (new_validators, f)
+            f.close ()
+
+            return True
+
+        print "Warning: could not fetch %s: %s" % (url, error)
+        return False
+
+    def fetch_all (self, downloads):
+        """
+        Fetch a list of (url, filename) pairs concurrently. Returns the
+        list of pairs that could not be fetched.
+        """
+        if len (downloads) == 0:
+            return []
+        if len (downloads) == 1:
+            # No need for a pool, and this thread's connections are reused
+            results = [self.fetch (*downloads[0])]
+        else:
+            pool = ThreadPool (min (self.connections, len (downloads)))
+            try:
+                results = pool.map (lambda (url, filename): self.fetch (url, filename),
+                                    downloads)
+            finally:
+                pool.close ()
+                pool.join ()
+
+        return [download for (download, ok) in zip (downloads, results) if not ok]
+
+def build_requires_needs_query (fedora_build_dep):
+    """
+    False for the BuildRequires that fedora_build_dependency_to_chunk() can
+    handle without asking Yum.
+    """
+    if fedora_build_dep in ['pkgconfig(xproto)', 'xorg-x11-xtrans-devel',
+                            'xorg-x11-proto-devel']:
+        return False
+    if fedora_build_dep.startswith('pkgconfig(') and fedora_build_dep.endswith('proto)'):
+        return False
+    return fedora_build_dep not in build_dep_ignore_list
+
+## Bump this whenever parse_build_requires() changes, so that results cached
+## by an older version are not used.
+##
+SPEC_PARSER_VERSION = 2
+
+MACRO_RE = re.compile (r'%(%|\{(\?!|!\?|\?)?([A-Za-z_][A-Za-z0-9_]*)(?::([^}]*))?\}|([A-Za-z_][A-Za-z0-9_]*))')
+DEPENDENCY_TOKEN_RE = re.compile (r'[<>=!]=?|[^\s,<>=!]+')
+VERSION_OPERATORS = ['<', '<=', '=', '==', '>=', '>', '!=']
+
+def expand_macros (text, macros, depth = 0, undefined = None):
+    """
+    Basic RPM macro expansion: %{name}, %name, %{?name}, %{?name:value} and
+    %{!?name:value}. Unknown macros are left alone, except conditional ones
+    which expand to nothing. The names of unknown macros are added to the set
+    'undefined', if one is given.
+    """
+    def expand (match):
+        if match.group (1) == '%':
+            return '%'
+
+        name = match.group (3) or match.group (5)
+        condition = match.group (2)
+        alternative = match.group (4)
+
+        if name not in macros and undefined is not None:
+            undefined.add (name)
+
+        if condition == '?':
+            if name not in macros:
+                return ''
+            return macros[name] if alternative is None else alternative
+        if condition in ['!?', '?!']:
+            if name in macros:
+                return ''
+            return alternative or ''
+
+        if name in macros:
+            return macros[name]
+        return match.group (0)
+
+    expanded = MACRO_RE.sub (expand, text)
+    if expanded != text and '%' in expanded and depth < 10:
+        return expand_macros (expanded, macros, depth + 1, undefined)
+    return expanded
+
+def evaluate_spec_condition (expression):
+    """
+    Evaluate the expanded expression of an %if. Returns None if the result
+    can't be known, which is anything that isn't a simple number or
+    comparison.
+    """
+    expression = expression.strip ()
+
+    match = re.match (r'^(\S+)\s*(==|!=|<=|>=|<|>)\s*(\S+)$', expression)
+    if match:
+        (a, op, b) = match.groups ()
+        try:
+            (a, b) = (int (a), int (b))
+        except ValueError:
+            a = a.strip ('"')
+            b = b.strip ('"')
+        return { '==': a == b, '!=': a != b, '<=': a <= b,
+                 '>=': a >= b, '<': a < b, '>': a > b }[op]
+
+    if expression.startswith ('!'):
+        result = evaluate_spec_condition (expression[1:])
+        return None if result is None else not result
+
+    try:
+        return int (expression) != 0
+    except ValueError:
+        return None
+
+def spec_condition (expression, macros):
+    """
+    True or False if the %if 'expression' is known to be so, otherwise None.
+    Conditions that use a macro the spec doesn't define are not known: those
+    are mostly ones like %{?fedora} and %{?rhel} that the build system
+    defines, and the spec could be built for any of them.
+    """
+    undefined = set ()
+    expanded = expand_macros (expression, macros, undefined = undefined)
+    if undefined:
+        return None
+    return evaluate_spec_condition (expanded)
+
+def parse_build_requires (spec_text):
+    """
+    Returns list of everything listed as BuildRequires: in a spec file, with
+    macros expanded, version constraints removed and %if blocks that are
+    known to be false skipped. Where a condition can't be known, both
+    branches are kept.
+    """
+    build_requires = []
+    macros = {}
+    # One entry per open %if: True or False if its current branch is known to
+    # be included or not, None if that isn't known.
+    conditions = []
+
+    for line in spec_text.splitlines ():
+        stripped = line.strip ()
+        words = stripped.split (None, 1)
+        keyword = words[0] if words else ''
+        rest = words[1] if len (words) > 1 else ''
+
+        if keyword == '%if':
+            conditions.append (spec_condition (rest, macros))
+            continue
+        if keyword in ['%ifarch', '%ifnarch', '%ifos', '%ifnos']:
+            # We don't know the target, so assume the block applies
+            conditions.append (True)
+            continue
+        if keyword == '%else':
+            if conditions and conditions[-1] is not None:
+                conditions[-1] = not conditions[-1]
+            continue
+        if keyword == '%endif':
+            if conditions:
+                conditions.pop ()
+            continue
+
+        if False in conditions:
+            continue
+
+        if keyword in ['%define', '%global']:
+            definition = rest.split (None, 1)
+            if len (definition) == 2:
+                macros[definition[0]] = definition[1].strip ()
+            continue
+
+        match = re.match (r'^BuildRequires\s*:\s*(.*)$', stripped, re.IGNORECASE)
+        if match is None:
+            continue
+
+        components = DEPENDENCY_TOKEN_RE.findall (expand_macros (match.group (1), macros))
+
+        while len (components) > 0:
+            dep = components.pop (0)
+            if dep in VERSION_OPERATORS:
+                # Constraint with no package, skip the version too
+                if len (components) > 0:
+                    components.pop (0)
+                continue
+            if len (components) >= 2 and components[0] in VERSION_OPERATORS:
+                del components [0:2]
+            build_requires.append (dep)
+
+    return build_requires
+
 
 class FedoraPackageDB ():
     # We need to map both ways, from Baserock chunk <--> Fedora package.
@@ -126,7 +569,7 @@ class FedoraPackageDB ():
         if fedora_build_dep in build_dep_ignore_list:
             return None
 
-        package_name = get_fedora_package_for_build_requires (owner, fedora_build_dep)
+        package_name = self.resolve_build_requires (owner, fedora_build_dep)
 
         if package_name is None:
             return None
@@ -141,6 +584,32 @@ class FedoraPackageDB ():
         if package_name in self.fedora_package_to_chunk:
             return self.fedora_package_to_chunk[package_name]
 
+    def resolve_build_requires (self, owner, fedora_build_dep):
+        """
+        Returns the package providing 'fedora_build_dep', asking Yum at most
+        once per run for each one.
+        """
+        if fedora_build_dep not in self.build_requires_packages:
+            if self.repo_index is not None:
+                package_name = self.repo_index.whatprovides (owner, fedora_build_dep)
+            else:
+                package_name = get_fedora_package_for_build_requires (owner, fedora_build_dep)
+            self.build_requires_packages[fedora_build_dep] = package_name
+        return self.build_requires_packages[fedora_build_dep]
+
+    def prefetch_build_requires (self, chunk_names):
+        """
+        Resolve every distinct BuildRequires of the given chunks up front, so
+        that get_build_depends() only has to do lookups.
+        """
+        for chunk_name in chunk_names:
+            spec_file = self.get_spec_file (chunk_name)
+            if not os.path.exists (spec_file):
+                continue
+            for dep in self.read_build_requires (spec_file):
+                if build_requires_needs_query (dep):
+                    self.resolve_build_requires (chunk_name, dep)
+
     def get_srcpackage_name (self, package_name):
         # We need a couple of special-cases here, because the source package
         # doesn't *have* to correspond to its output packages at all
@@ -153,68 +622,200 @@ class FedoraPackageDB ():
     # However, Fedora can throw a lot more at us in BuildRequires: so this
     # function is not simple either.
 
-    def __init__ (self, cache_path, chunk_dict):
+    # 'chunk_list' is the names of every chunk in the stratum, in stratum
+    # order (ChunkIndex.names()), which is the order their build-depends will
+    # be asked for in.
+    #
+    # In lazy mode nothing is checked or downloaded until get_build_depends()
+    # is first called for a chunk. With 'prefetch' as well, a background
+    # thread works through the chunks in 'chunk_list' order in the meantime,
+    # so it stays just ahead of the caller.
+
+    def __init__ (self, cache_path, chunk_list, repo_index = None,
+                  lazy = False, prefetch = False):
         self.cache_path = cache_path
-        self.chunk_list = chunk_dict.keys()
+        self.repo_index = repo_index
+        self.chunk_list = list (chunk_list)
+        self.chunk_names = set (self.chunk_list)
+        # Shared by every download, so connections are reused between them
+        self.fetcher = SpecFetcher ()
         self.fedora_package_to_chunk = {}
+        self.build_requires_packages = {}
+        # Spec file SHA-1 -> list of BuildRequires
+        self.spec_build_requires = {}
+        # Spec files whose download failed; any copy left from an earlier
+        # run is used as it is
+        self.failed_spec_files = set ()
+
+        # Chunk name -> threading.Event, set once the chunk is resolved
+        self.chunk_resolved = {}
+        self.chunk_has_package = {}
+        self.chunk_lock = threading.Lock ()
 
         if not os.path.exists (self.cache_path):
             os.makedirs (self.cache_path)
 
+        candidates = []
         for chunk_name in self.chunk_list:
             if chunk_name in fedora_ignore_list or chunk_name.startswith("xorg-proto-"):
                 # These are all just xorg-x11-proto-devel in Fedora
                 continue
 
-            fedora_package_name = self.chunk_to_fedora_package (chunk_name)
+            candidates.append ((chunk_name, self.chunk_to_fedora_package (chunk_name)))
+
+        if lazy:
+            # Anything whatprovides returns exists, so the reverse mapping
+            # doesn't need checking.
+            for (chunk_name, fedora_package_name) in candidates:
+                self.fedora_package_to_chunk[fedora_package_name] = chunk_name
+
+            if prefetch:
+                thread = threading.Thread (target = self.prefetch_chunks,
+                                           args = ([c for (c, p) in candidates],))
+                thread.daemon = True
+                thread.start ()
+            return
 
-            if check_package_exists (fedora_package_name) == False:
+        with tony_stats.phase ('fedora-package-check'):
+            present_packages = self.packages_exist (
+                [fedora_package_name for (chunk_name, fedora_package_name) in candidates])
+
+        for (chunk_name, fedora_package_name) in candidates:
+            done = threading.Event ()
+            done.set ()
+            self.chunk_resolved[chunk_name] = done
+            self.chunk_has_package[chunk_name] = fedora_package_name in present_packages
+
+            if fedora_package_name not in present_packages:
                 print ('No Fedora package for chunk %s (tried %s)' % (chunk_name, fedora_package_name))
                 continue
 
             self.fedora_package_to_chunk[fedora_package_name] = chunk_name
 
-            self.check_and_download_spec_file (self.get_srcpackage_name (fedora_package_name))
+        self.download_spec_files ([self.get_srcpackage_name (p)
+                                   for p in self.fedora_package_to_chunk.keys ()])
+
+        with tony_stats.phase ('fedora-build-requires'):
+            self.prefetch_build_requires (self.fedora_package_to_chunk.values ())
+
+    def packages_exist (self, names):
+        if self.repo_index is not None:
+            return self.repo_index.packages_exist (names)
+        else:
+            return check_packages_exist (names)
+
+    def resolve_chunk (self, chunk_name):
+        """
+        Check the Fedora package for one chunk exists and fetch its spec file,
+        if that hasn't been done already. Returns True if there is a package.
+        """
+        with self.chunk_lock:
+            done = self.chunk_resolved.get (chunk_name)
+            owner = done is None
+            if owner:
+                done = threading.Event ()
+                self.chunk_resolved[chunk_name] = done
+
+        if not owner:
+            done.wait ()
+            return self.chunk_has_package[chunk_name]
+
+        has_package = False
+        try:
+            fedora_package_name = self.chunk_to_fedora_package (chunk_name)
+            has_package = len (self.packages_exist ([fedora_package_name])) > 0
 
-    def check_and_download_spec_file (self, srcpackage_name):
-        spec_file_name = os.path.join (self.cache_path, srcpackage_name + '.spec')
+            if has_package:
+                self.download_spec_files ([self.get_srcpackage_name (fedora_package_name)])
+                self.prefetch_build_requires ([chunk_name])
+            else:
+                print ('No Fedora package for chunk %s (tried %s)' % (chunk_name, fedora_package_name))
+        finally:
+            self.chunk_has_package[chunk_name] = has_package
+            done.set ()
+
+        return has_package
+
+    def prefetch_chunks (self, chunk_names):
+        for chunk_name in chunk_names:
+            try:
+                self.resolve_chunk (chunk_name)
+            except Exception as e:
+                print "Warning: %s: prefetch failed: %s" % (chunk_name, e)
+
+    def read_build_requires (self, spec_file):
+        """
+        Returns the BuildRequires of a spec file, parsing each distinct spec
+        only once. Results are cached in memory and in the spec cache
+        directory, keyed by the SHA-1 of the spec file.
+        """
+        f = open (spec_file, "r")
+        spec_text = f.read ()
+        f.close ()
+        tony_stats.count_file_read (spec_file)
 
-        if os.path.exists(spec_file_name) and os.stat(spec_file_name).st_size > 0:
-            return
+        spec_hash = hashlib.sha1 (spec_text).hexdigest ()
+
+        if spec_hash in self.spec_build_requires:
+            return self.spec_build_requires[spec_hash]
 
+        parsed_path = os.path.join (self.cache_path,
+                                    'build-requires-v%i' % SPEC_PARSER_VERSION)
+        parsed_file = os.path.join (parsed_path, spec_hash + '.json')
+
+        build_requires = tony_cache.load (parsed_file)
+        if build_requires is None:
+            tony_stats.count ('specs-parsed')
+            build_requires = parse_build_requires (spec_text)
+            tony_cache.save (parsed_file, build_requires)
+
+        self.spec_build_requires[spec_hash] = build_requires
+        return build_requires
+
+    def get_spec_file_url (self, srcpackage_name):
         # Scrape from Fedora's gitweb
         FEDORA_SPEC_FILE_URL = "http://pkgs.fedoraproject.org/gitweb/?p=%s.git;a=blob_plain;f=%s.spec"
-        spec_url = FEDORA_SPEC_FILE_URL % (srcpackage_name, srcpackage_name)
-        subprocess.call ('wget -c "%s" --output-document=%s' % (spec_url, spec_file_name), shell = True)
+        return FEDORA_SPEC_FILE_URL % (srcpackage_name, srcpackage_name)
 
+    def download_spec_files (self, srcpackage_names):
+        downloads = [(self.get_spec_file_url (name),
+                      os.path.join (self.cache_path, name + '.spec'))
+                     for name in sorted (set (srcpackage_names))]
+        with tony_stats.phase ('fedora-spec-fetch'):
+            failed = self.fetcher.fetch_all (downloads)
+        self.failed_spec_files.update (filename for (url, filename) in failed)
 
-    def get_build_depends (self, chunk_name):
-        chunk_fedora_package_name = self.chunk_to_fedora_package (chunk_name)
+    def check_and_download_spec_file (self, srcpackage_name):
+        self.download_spec_files ([srcpackage_name])
 
-        spec_file = os.path.join (self.cache_path, self.get_srcpackage_name (chunk_fedora_package_name) + '.spec')
 
-        chunk_build_depends_list = []
+    def get_spec_file (self, chunk_name):
+        chunk_fedora_package_name = self.chunk_to_fedora_package (chunk_name)
+        return os.path.join (self.cache_path, self.get_srcpackage_name (chunk_fedora_package_name) + '.spec')
 
-        f = open (spec_file, "r")
-        for line in f:
-            if not line.startswith('BuildRequires:'):
-                continue
+    def get_build_depends (self, chunk_name):
+        if not self.resolve_chunk (chunk_name):
+            return []
 
-            components = line.split()[1:]
+        spec_file = self.get_spec_file (chunk_name)
+        if not os.path.exists (spec_file):
+            if spec_file in self.failed_spec_files:
+                print "Warning: %s: spec file could not be fetched, so no build-depends" % chunk_name
+            else:
+                print "Warning: %s: no spec file at %s, so no build-depends" % (chunk_name, spec_file)
+            return []
 
-            while len (components) > 0:
-                dep = components.pop(0)
-                if len (components) >= 2 and components[0] == '>=':
-                    del components [0:2]
+        chunk_build_depends_list = []
 
-                dep_chunk_name = self.fedora_build_dependency_to_chunk (chunk_name, dep)
+        for dep in self.read_build_requires (spec_file):
+            dep_chunk_name = self.fedora_build_dependency_to_chunk (chunk_name, dep)
 
-                if dep_chunk_name is None:
-                    # Ignored, should have given an error already
-                    pass
-                elif dep_chunk_name not in self.chunk_list:
-                    print "Warning: %s has unknown dep: '%s'" % (chunk_name, dep_chunk_name)
-                else:
-                    chunk_build_depends_list.append (dep_chunk_name)
+            if dep_chunk_name is None:
+                # Ignored, should have given an error already
+                pass
+            elif dep_chunk_name not in self.chunk_names:
+                print "Warning: %s has unknown dep: '%s'" % (chunk_name, dep_chunk_name)
+            else:
+                chunk_build_depends_list.append (dep_chunk_name)
 
         return chunk_build_depends_list
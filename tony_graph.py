@@ -0,0 +1,234 @@
+## Dependency graph algorithms shared by the stratum tools.
+##
+## Graphs are passed around as a dict mapping each node name to an iterable of
+## the names it depends on.
+
+import heapq
+
+
+class DependencyCycleError(Exception):
+    def __init__(self, cycles):
+        self.cycles = cycles
+        Exception.__init__(self, "Dependency cycle: " +
+                           "; ".join(", ".join(c) for c in cycles))
+
+
+def chunk_sort_key(name):
+    '''Case-insensitive alphabetical order, as used for strata'''
+    return (name.lower(), name)
+
+
+def find_cycles(deps):
+    '''Returns list of strongly connected components of 'deps' that contain a
+    cycle, each one a sorted list of node names.
+    '''
+    # Tarjan's algorithm, iteratively so deep strata don't hit the recursion
+    # limit.
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    cycles = []
+    counter = 0
+
+    for root in sorted(deps, key=chunk_sort_key):
+        if root in index:
+            continue
+
+        work = [(root, iter(deps[root]))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if child not in deps:
+                    continue
+                if child not in index:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(deps[child])))
+                    advanced = True
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if advanced:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1 or node in deps[node]:
+                    cycles.append(sorted(component, key=chunk_sort_key))
+
+    return cycles
+
+
+def topological_sort(deps, key=chunk_sort_key):
+    '''Returns the nodes of 'deps' ordered so that every node comes after the
+    nodes it depends on. Dependencies on nodes that are not in 'deps' are
+    ignored.
+
+    The order is the one the old "try-try-again" sort produced, so existing
+    strata keep their order: nodes are sorted by 'key', then taken in passes
+    over that list, each pass taking every node whose dependencies have been
+    taken already, including earlier in the same pass.
+
+    Raises DependencyCycleError if the graph cannot be ordered.
+    '''
+    dependents = dict((name, []) for name in deps)
+    waiting_on = {}
+
+    for name, name_deps in deps.items():
+        name_deps = set(d for d in name_deps if d in deps)
+        waiting_on[name] = len(name_deps)
+        for d in name_deps:
+            dependents[d].append(name)
+
+    # Kahn's algorithm finds an order to work out the passes in
+    order = [name for name, count in waiting_on.items() if count == 0]
+    for name in order:
+        for dependent in dependents[name]:
+            waiting_on[dependent] -= 1
+            if waiting_on[dependent] == 0:
+                order.append(dependent)
+
+    if len(order) < len(deps):
+        remaining = set(deps).difference(order)
+        raise DependencyCycleError(find_cycles(
+            dict((name, [d for d in deps[name] if d in remaining])
+                 for name in remaining)))
+
+    # A node is taken in the same pass as a dependency that sorts before it,
+    # or in the pass after one that sorts after it.
+    sort_key = dict((name, key(name)) for name in deps)
+    taken_in = {}
+    for name in order:
+        taken_in[name] = max([taken_in[d] + (sort_key[d] > sort_key[name])
+                              for d in deps[name] if d in deps] or [0])
+
+    return sorted(deps, key=lambda name: (taken_in[name], sort_key[name]))
+
+
+def transitive_reduction(deps):
+    '''Returns a dict mapping each node of 'deps' to its dependencies, in their
+    original order, without those that are also reachable through another
+    dependency. Dependencies on nodes that are not in 'deps' are kept.
+
+    Raises DependencyCycleError if the graph has a cycle.
+    '''
+    order = topological_sort(deps)
+    bit = dict((name, 1 << i) for (i, name) in enumerate(order))
+
+    # Node -> bitset of every node it depends on, directly or indirectly.
+    # Dependencies always come earlier in 'order', so are done first.
+    reachable = {}
+    for name in order:
+        reach = 0
+        for d in deps[name]:
+            if d in bit:
+                reach |= bit[d] | reachable[d]
+        reachable[name] = reach
+
+    result = {}
+    for name in order:
+        indirect = 0
+        for d in deps[name]:
+            if d in bit:
+                indirect |= reachable[d]
+        result[name] = [d for d in deps[name]
+                        if d not in bit or not (bit[d] & indirect)]
+    return result
+
+
+def _dependents(deps):
+    dependents = dict((name, []) for name in deps)
+    for name, name_deps in deps.items():
+        for d in set(name_deps):
+            if d in deps:
+                dependents[d].append(name)
+    return dependents
+
+
+def longest_paths(deps, weight, key=chunk_sort_key):
+    '''Returns a dict mapping each node of 'deps' to (finish, via): 'finish' is
+    the total 'weight' of the heaviest chain of dependencies ending with that
+    node, and 'via' the dependency that chain comes through, or None. With
+    a weight of 1 for every node, 'finish' is the node's level in the graph.
+    '''
+    result = {}
+    for name in topological_sort(deps, key):
+        start, via = 0, None
+        for d in deps[name]:
+            if d in result and result[d][0] > start:
+                start, via = result[d][0], d
+        result[name] = (start + weight(name), via)
+    return result
+
+
+def list_schedule(deps, weight, workers, key=chunk_sort_key):
+    '''Simulates building 'deps' with 'workers' builders, each one always
+    taking the ready node with the heaviest chain of dependents still to
+    come. Nodes with no weight take no builder. Returns list of (start,
+    finish, worker, node) tuples, in order of starting.
+
+    Raises ValueError if 'workers' is less than 1, as nothing could start.
+    '''
+    if workers < 1:
+        raise ValueError("list_schedule needs at least one worker, not %i" % workers)
+
+    dependents = _dependents(deps)
+
+    # Node -> weight of the heaviest chain from it to the end of the build
+    rank = {}
+    for name in reversed(topological_sort(deps, key)):
+        rank[name] = weight(name) + max([rank[d] for d in dependents[name]] or [0])
+
+    waiting_on = dict((name, len(set(d for d in name_deps if d in deps)))
+                      for name, name_deps in deps.items())
+    ready = [(-rank[name], key(name), name)
+             for name, count in waiting_on.items() if count == 0]
+    heapq.heapify(ready)
+    running = []
+    free_workers = list(range(workers))
+    heapq.heapify(free_workers)
+    now = 0
+    result = []
+
+    def finished(name):
+        for dependent in dependents[name]:
+            waiting_on[dependent] -= 1
+            if waiting_on[dependent] == 0:
+                heapq.heappush(ready, (-rank[dependent], key(dependent), dependent))
+
+    while ready or running:
+        while ready and (free_workers or weight(ready[0][2]) == 0):
+            name = heapq.heappop(ready)[2]
+            if weight(name) == 0:
+                finished(name)
+                continue
+            worker = heapq.heappop(free_workers)
+            result.append((now, now + weight(name), worker, name))
+            heapq.heappush(running, (now + weight(name), worker, name))
+
+        if running:
+            now, worker, name = heapq.heappop(running)
+            heapq.heappush(free_workers, worker)
+            finished(name)
+
+    return result
@@ -1,14 +1,22 @@
 ## Import chunk information from jhbuild modulesets
 
+import hashlib
+import multiprocessing
 import os
-import xml.dom.minidom
+import xml.etree.cElementTree as ElementTree
+
+import tony_cache
+import tony_stats
 
 def jhbuild_to_chunk_name(module):
     if module == 'gtk-doc':
         return 'gtk-doc-stub'
     return module
 
-def jhbuild_to_morph_repo(repo_dict, repo, module):
+def _print_warning(message):
+    print message
+
+def jhbuild_to_morph_repo(repo_dict, repo, module, warn=_print_warning):
     if repo == 'git.gnome.org':
         return "gnome:%s" % module
 
@@ -19,94 +27,296 @@ def jhbuild_to_morph_repo(repo_dict, repo, module):
         else:
             return repo_dict[repo] + '/' + module
 
-    print "%s: Unknown repo: %s" % (module, repo)
+    warn("%s: Unknown repo: %s" % (module, repo))
     return None
 
 
+MODULE_TAGS = ['autotools', 'tarball', 'cmake', 'metamodule']
+
+def _encode(value):
+    '''UTF-8 str in place of every unicode string in 'value'. ElementTree
+    returns unicode for anything that isn't ASCII and json returns it for
+    everything, but the rest of tony, including the writer, expects str.
+    '''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_encode(v) for v in value)
+    if isinstance(value, dict):
+        return dict((_encode(k), _encode(v)) for (k, v) in value.items())
+    return value
+
+def _read_module(element):
+    '''Returns tuple of (name, parallel_builds, deps, branch) for one module
+    element, where 'branch' is None or a tuple of (repo, module, patches).
+    '''
+    name = element.get("id", "")
+    parallel_builds = element.get("supports-parallel-builds") != "no"
+
+    #autogen_args = element.get("autogen-sh") or element.get("autogenargs")
+    #if autogen_args:
+    #    print "%s: %s" % (name, autogen_args)
+
+    deps = []
+    for dependencies in element.iter("dependencies"):
+        deps = [dep.get("package", "") for dep in dependencies.iter("dep")]
+        break
+
+    branch = None
+    for branch_element in element.iter("branch"):
+        branch = (branch_element.get("repo", ""),
+                  branch_element.get("module", ""),
+                  [p.get("file", "") for p in branch_element.iter("patch")])
+        break
+
+    return (name, parallel_builds, deps, branch)
+
+def read_jhbuild_moduleset(path):
+    '''Parse a jhbuild moduleset in one streaming pass.
+
+    Returns a dict mapping 'repository' to a list of (name, href, default)
+    for each git repository, and each of MODULE_TAGS to a list of module
+    tuples as returned by _read_module(), all in document order.
+    '''
+    moduleset = dict((tag, []) for tag in MODULE_TAGS)
+    moduleset['repository'] = []
+
+    root = None
+    depth = 0
+    for (event, element) in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+
+        if element.tag == "repository":
+            if element.get("type") == "git":
+                moduleset['repository'].append((element.get("name", ""),
+                                                element.get("href", ""),
+                                                element.get("default") == "yes"))
+        elif element.tag in MODULE_TAGS:
+            moduleset[element.tag].append(_read_module(element))
+
+        # Free each top-level element once it has been dealt with
+        if depth == 1:
+            root.clear()
+
+    return _encode(moduleset)
+
+
+## Parsed modulesets are cached here between runs. Pass cache_path=None to
+## JhbuildModules to bypass the cache. The warnings printed while parsing are
+## cached too, and printed again when the cache is used.
+##
+## Bump JHBUILD_CACHE_VERSION whenever the parsing or the cache format
+## changes, so that entries written by older code are not used.
+##
+JHBUILD_CACHE_PATH = os.path.expanduser('~/.cache/tony/jhbuild')
+JHBUILD_CACHE_MAX_ENTRIES = 16
+JHBUILD_CACHE_VERSION = 2
+
+def _hash_file(path):
+    f = open(path, 'rb')
+    try:
+        return hashlib.sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+
 class JhbuildModules():
-    def __init__(self, jhbuild_path, jhbuild_inputs, ignore_list):
+    def __init__(self, jhbuild_path, jhbuild_inputs, ignore_list,
+                 cache_path = JHBUILD_CACHE_PATH, parallel = False):
         self.module_deps = {}
         self.module_repos = {}
         self.metamodule_deps = {}
+        self.repositories = {}
         self.ignore_list = ignore_list
+        # Warnings printed while parsing, in order
+        self.warnings = []
+
+        paths = [os.path.join(jhbuild_path, 'modulesets', m)
+                 for m in jhbuild_inputs]
+
+        cache_file = None
+        if cache_path is not None:
+            cache_file = os.path.join(cache_path,
+                                      self._cache_key(paths) + '.json')
+            with tony_stats.phase('jhbuild-cache-load'):
+                if self._load_cache(cache_file):
+                    tony_stats.count('jhbuild-cache-hits')
+                    return
+
+        # Each file parses independently; the results are merged in input
+        # order so the first file to define a module still wins.
+        for f in paths:
+            tony_stats.count('modulesets-parsed')
+            tony_stats.count_file_read(f)
+
+        if parallel and len(paths) > 1:
+            pool = multiprocessing.Pool(min(len(paths), multiprocessing.cpu_count()))
+            try:
+                modulesets = pool.map(read_jhbuild_moduleset, paths)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            modulesets = [read_jhbuild_moduleset(f) for f in paths]
+
+        for (f, moduleset) in zip(paths, modulesets):
+            self._parse_jhbuild_moduleset(f, moduleset)
 
-        for m in jhbuild_inputs:
-            f = os.path.join(jhbuild_path, 'modulesets', m)
-            self._parse_jhbuild_moduleset(f)
+        with tony_stats.phase('jhbuild-closure-index'):
+            self._build_closure_index()
 
+        if cache_file is not None:
+            self._save_cache(cache_file)
 
-    def _parse_module_deps(self, node, path):
-        name = node.getAttribute("id")
 
-        if node.getAttribute("supports-parallel-builds") == "no":
-            print "%s: no parallel builds" % name
+    def _cache_key(self, paths):
+        key = hashlib.sha1()
+        key.update("version %i\n" % JHBUILD_CACHE_VERSION)
+        for path in paths:
+            key.update("%s %s\n" % (os.path.basename(path), _hash_file(path)))
+        for module in sorted(self.ignore_list):
+            key.update("ignore %s\n" % module)
+        return key.hexdigest()
 
-        #autogen_args = node.getAttribute("autogen-sh") or node.getAttribute("autogenargs")
-        #if autogen_args:
-        #    print "%s: %s" % (name, autogen_args)
+    def _load_cache(self, cache_file):
+        data = tony_cache.load(cache_file)
+        if data is None:
+            return False
+        data = _encode(data)
 
-        dependencies_tag_list = node.getElementsByTagName("dependencies")
+        self.module_deps = dict((m, set(deps)) for (m, deps)
+                                in data['module_deps'].items())
+        self.module_repos = data['module_repos']
+        self.metamodule_deps = dict((m, set(deps)) for (m, deps)
+                                    in data['metamodule_deps'].items())
+        self.repositories = data['repositories']
+        self.module_closure = dict((m, frozenset(deps)) for (m, deps)
+                                   in data['module_closure'].items())
 
-        dependencies_list = set()
-        if dependencies_tag_list != []:
-            for component in dependencies_tag_list[0].getElementsByTagName("dep"):
-                dep_name = component.getAttribute ("package")
-                dependencies_list.add (dep_name)
+        for message in data['warnings']:
+            self._warn(message)
+        return True
 
-        return (name, dependencies_list)
+    def _save_cache(self, cache_file):
+        def as_lists(d):
+            return dict((k, sorted(v)) for (k, v) in d.items())
 
+        data = {
+            'module_deps': as_lists(self.module_deps),
+            'module_repos': self.module_repos,
+            'metamodule_deps': as_lists(self.metamodule_deps),
+            'repositories': self.repositories,
+            'module_closure': as_lists(self.module_closure),
+            'warnings': self.warnings,
+        }
+        tony_cache.save(cache_file, data, JHBUILD_CACHE_MAX_ENTRIES)
 
-    def _parse_jhbuild_moduleset(self, path):
-        dom = xml.dom.minidom.parse(path)
 
-        base = dom.getElementsByTagName("moduleset")[0]
+    def _warn(self, message):
+        print message
+        self.warnings.append(message)
 
+    def _parse_module_deps(self, module):
+        (name, parallel_builds, deps, branch) = module
+
+        if not parallel_builds:
+            self._warn("%s: no parallel builds" % name)
+
+        return (name, set(deps))
+
+
+    def _parse_jhbuild_moduleset(self, path, moduleset):
         default_repo = None
         repo_dict = {}
-        for repo in base.getElementsByTagName("repository"):
-            if repo.getAttribute("type") != "git":
-                continue
-
-            name = repo.getAttribute("name")
-            href = repo.getAttribute("href")
+        for (name, href, default) in moduleset['repository']:
             repo_dict[name] = href
+            self.repositories.setdefault(name, href)
 
-            if repo.getAttribute("default") == "yes":
+            if default:
                 default_repo = name
 
-        for module_list in [base.getElementsByTagName("autotools"),
-                            base.getElementsByTagName("tarball"),
-                            base.getElementsByTagName("cmake")]:
-            for element in module_list:
-                (name, deps) = self._parse_module_deps(element, path)
+        for module_list in [moduleset['autotools'],
+                            moduleset['tarball'],
+                            moduleset['cmake']]:
+            for module in module_list:
+                (name, deps) = self._parse_module_deps(module)
 
                 if name in self.module_deps:
-                    print ("Warning: duplicate module '%s' in %s" % (name, path))
+                    self._warn("Warning: duplicate module '%s' in %s" % (name, path))
                     continue
 
                 self.module_deps[name] = deps
 
-                branch = element.getElementsByTagName("branch")
-                if len(branch) > 0:
-                    branch = branch[0]
-                    for p in branch.getElementsByTagName("patch"):
-                        print "%s: patch: %s" % (name, p.getAttribute("file"))
-                    repo = branch.getAttribute("repo") or default_repo
-                    module = branch.getAttribute("module") or name
+                branch = module[3]
+                if branch is not None:
+                    (repo, branch_module, patches) = branch
+                    for p in patches:
+                        self._warn("%s: patch: %s" % (name, p))
+                    repo = repo or default_repo
+                    branch_module = branch_module or name
 
                     self.module_repos[name] = jhbuild_to_morph_repo(repo_dict,
                                                                     repo,
-                                                                    module)
+                                                                    branch_module,
+                                                                    self._warn)
 
-        for element in base.getElementsByTagName("metamodule"):
-            (name, deps) = self._parse_module_deps(element, path)
+        for module in moduleset['metamodule']:
+            (name, deps) = self._parse_module_deps(module)
 
             if name in self.metamodule_deps:
-                print ("Warning: duplicate metamodule '%s' in %s" % (name, path))
+                self._warn("Warning: duplicate metamodule '%s' in %s" % (name, path))
                 continue
             self.metamodule_deps[name] = deps
 
 
+    def _build_closure_index(self):
+        '''Work out the full set of dependencies of every module, once.'''
+        self.module_closure = {}
+
+        for root in self.module_deps:
+            if root in self.module_closure:
+                continue
+
+            # Iterative post-order walk; a module's closure is finished once
+            # all of its dependencies' closures are.
+            in_progress = set([root])
+            work = [(root, iter(self.module_deps[root]))]
+            while work:
+                module, deps = work[-1]
+                descended = False
+                for dep in deps:
+                    if dep in self.ignore_list or dep in self.module_closure:
+                        continue
+                    if dep not in self.module_deps:
+                        continue
+                    if dep in in_progress:
+                        self._warn("Warning: dependency cycle between %s and %s" % (module, dep))
+                        continue
+                    in_progress.add(dep)
+                    work.append((dep, iter(self.module_deps[dep])))
+                    descended = True
+                    break
+                if descended:
+                    continue
+
+                work.pop()
+                in_progress.discard(module)
+
+                closure = set(self.module_deps[module]).difference(self.ignore_list)
+                for dep in list(closure):
+                    closure.update(self.module_closure.get(dep, ()))
+                self.module_closure[module] = frozenset(closure)
+
+        tony_stats.count('graph-nodes', len(self.module_deps))
+        tony_stats.count('graph-edges', sum(len(d) for d in self.module_deps.values()))
+
     def dump(self):
         print "Modules:"
         for m in self.module_deps.keys():
@@ -120,23 +330,19 @@ class JhbuildModules():
 
     def chunk_is_module (self, chunk):
         '''True if Baserock chunk name exists as a jhbuild module as well'''
-        return chunk in self.module_deps.keys()
+        return chunk in self.module_deps
 
     def get_module_list(self, metamodule):
         '''Get full set of modules required for one overall component'''
-        def collect_deps(module_list):
-            result = set(module_list)
-            result = result.difference(self.ignore_list)
-
-            for module in result:
-                if module not in self.module_deps:
-                    print "Unknown module: %s" % module
-                    continue
+        result = set(self.metamodule_deps[metamodule]).difference(self.ignore_list)
+        for module in list(result):
+            if module in self.module_closure:
+                result.update(self.module_closure[module])
 
-                result = result.union(collect_deps(self.module_deps[module]))
-            return result
+        for module in sorted(result.difference(self.module_deps)):
+            print "Unknown module: %s" % module
 
-        return collect_deps(self.metamodule_deps[metamodule])
+        return result
 
     def get_module_build_depends(self, module):
         build_depends = set(jhbuild_to_chunk_name(m) \
@@ -0,0 +1,105 @@
+## Choose the JSON document backend, and write morphologies in Baserock's
+## formatting.
+##
+## The default backend is tony_pyjson, which is plain Python. Set
+## TONY_JSON_BACKEND=glib in the environment to use JSON-GLib through GObject
+## introspection instead. Either way, use 'from tony_json import Json'.
+##
+## This is what JSON-GLib's pretty generator produces with an indent of 4,
+## except that there is no space before the ':' after simple object keys, and
+## empty arrays that are object members are written as '[]'. The output is
+## written piece by piece to whatever file-like object dump_morphology() is
+## given as the tree is walked, without building intermediate strings for
+## the nested nodes. tony.write_json_postprocessed() gives it a StringIO, so
+## that it can compare the result with the existing file before writing.
+
+import os
+import re
+
+JSON_BACKEND = os.environ.get ('TONY_JSON_BACKEND', 'python')
+
+if JSON_BACKEND == 'glib':
+    from gi.repository import GObject, Json
+    TYPE_STRING = GObject.TYPE_STRING
+    TYPE_BOOLEAN = GObject.TYPE_BOOLEAN
+    TYPE_DOUBLE = GObject.TYPE_DOUBLE
+elif JSON_BACKEND == 'python':
+    import tony_pyjson as Json
+    from tony_pyjson import TYPE_STRING, TYPE_BOOLEAN, TYPE_DOUBLE
+else:
+    raise Exception ("Unknown TONY_JSON_BACKEND '%s', expected 'python' or 'glib'" % JSON_BACKEND)
+
+INDENT = 4
+
+SIMPLE_KEY_RE = re.compile ('^[A-Za-z0-9-_]+$')
+ESCAPE_RE = re.compile ('[\\x00-\\x1f"\\\\]')
+ESCAPES = {
+    '"': '\\"', '\\': '\\\\', '\b': '\\b', '\f': '\\f',
+    '\n': '\\n', '\r': '\\r', '\t': '\\t'
+}
+
+def escape_string (value):
+    def escape_char (match):
+        c = match.group (0)
+        return ESCAPES.get (c, '\\u%04x' % ord (c))
+    return '"' + ESCAPE_RE.sub (escape_char, value) + '"'
+
+def _format_value (node):
+    value_type = node.get_value_type ()
+
+    if value_type == TYPE_STRING:
+        return escape_string (node.get_string ())
+    elif value_type == TYPE_BOOLEAN:
+        return 'true' if node.get_boolean () else 'false'
+    elif value_type == TYPE_DOUBLE:
+        return '%.17g' % node.get_double ()
+    else:
+        return str (node.get_int ())
+
+def _dump_node (write, node, level, name = None):
+    indent = ' ' * (level * INDENT)
+
+    prefix = indent
+    if name is not None:
+        if SIMPLE_KEY_RE.match (name):
+            prefix += escape_string (name) + ': '
+        else:
+            prefix += escape_string (name) + ' : '
+
+    node_type = node.get_node_type ()
+
+    if node_type == Json.NodeType.OBJECT:
+        json_object = node.get_object ()
+        members = json_object.get_members ()
+
+        write (prefix + '{\n')
+        for i, member in enumerate (members):
+            _dump_node (write, json_object.get_member (member), level + 1, member)
+            write (',\n' if i < len (members) - 1 else '\n')
+        write (indent + '}')
+
+    elif node_type == Json.NodeType.ARRAY:
+        elements = node.get_array ().get_elements ()
+
+        if len (elements) == 0 and name is not None:
+            write (prefix + '[]')
+            return
+
+        write (prefix + '[\n')
+        for i, element in enumerate (elements):
+            _dump_node (write, element, level + 1)
+            write (',\n' if i < len (elements) - 1 else '\n')
+        write (indent + ']')
+
+    elif node_type == Json.NodeType.NULL:
+        write (prefix + 'null')
+
+    else:
+        write (prefix + _format_value (node))
+
+def dump_morphology (out, root_node):
+    """
+    Write 'root_node' to the file-like object 'out', followed by a newline.
+    """
+    _dump_node (out.write, root_node, 0)
+    out.write ('\n')
@@ -0,0 +1,274 @@
+## Order-preserving stand-in for the parts of JSON-GLib that tony uses, built
+## on Python's json module.
+##
+## Member order is kept by parsing objects with object_pairs_hook, and the
+## classes below mirror the Json.Node / Json.Object / Json.Array / Json.Parser
+## / Json.Builder methods so the rest of tony doesn't care which is in use.
+## Strings are kept as UTF-8 encoded 'str', like PyGObject returns them.
+
+import json
+from collections import OrderedDict
+
+## Returned by Node.get_value_type()
+TYPE_STRING = str
+TYPE_BOOLEAN = bool
+TYPE_DOUBLE = float
+TYPE_INT64 = int
+
+
+class NodeType ():
+    OBJECT = 'object'
+    ARRAY = 'array'
+    VALUE = 'value'
+    NULL = 'null'
+
+
+def _encode (value):
+    if isinstance (value, unicode):
+        return value.encode ('utf-8')
+    return value
+
+def _to_node (value):
+    if isinstance (value, Object):
+        return Node (value)
+    if isinstance (value, list):
+        return Node (Array ([_to_node (v) for v in value]))
+    return Node (_encode (value))
+
+def _object_from_pairs (pairs):
+    return Object (OrderedDict ((_encode (k), _to_node (v)) for (k, v) in pairs))
+
+
+class Node ():
+    def __init__ (self, value = None):
+        # An Object, an Array, a string, number or boolean, or None
+        self.value = value
+
+    def get_node_type (self):
+        if isinstance (self.value, Object):
+            return NodeType.OBJECT
+        if isinstance (self.value, Array):
+            return NodeType.ARRAY
+        if self.value is None:
+            return NodeType.NULL
+        return NodeType.VALUE
+
+    def get_value_type (self):
+        if isinstance (self.value, bool):
+            return TYPE_BOOLEAN
+        if isinstance (self.value, (int, long)):
+            return TYPE_INT64
+        if isinstance (self.value, float):
+            return TYPE_DOUBLE
+        return TYPE_STRING
+
+    def get_object (self):
+        return self.value if isinstance (self.value, Object) else None
+
+    def get_array (self):
+        return self.value if isinstance (self.value, Array) else None
+
+    def get_string (self):
+        return self.value if isinstance (self.value, basestring) else None
+
+    def get_int (self):
+        return self.value
+
+    def get_boolean (self):
+        return self.value
+
+    def get_double (self):
+        return self.value
+
+    def set_string (self, value):
+        self.value = value
+
+    def set_object (self, value):
+        self.value = value
+
+    def set_array (self, value):
+        self.value = value
+
+    def copy (self):
+        if isinstance (self.value, (Object, Array)):
+            return Node (self.value.copy ())
+        return Node (self.value)
+
+
+class Object ():
+    def __init__ (self, members = None):
+        self.members = members if members is not None else OrderedDict ()
+
+    def copy (self):
+        return Object (OrderedDict ((k, v.copy ()) for (k, v) in self.members.items ()))
+
+    def get_members (self):
+        return list (self.members.keys ())
+
+    def get_size (self):
+        return len (self.members)
+
+    def has_member (self, name):
+        return name in self.members
+
+    def get_member (self, name):
+        return self.members.get (name)
+
+    def get_array_member (self, name):
+        return self.members[name].get_array ()
+
+    def get_object_member (self, name):
+        return self.members[name].get_object ()
+
+    def get_string_member (self, name):
+        return self.members[name].get_string ()
+
+    # As with JSON-GLib, replacing a member keeps its position and adding a
+    # new one puts it at the end.
+    def set_member (self, name, node):
+        self.members[name] = node
+
+    def set_string_member (self, name, value):
+        self.members[name] = Node (value)
+
+    def set_int_member (self, name, value):
+        self.members[name] = Node (value)
+
+    def set_boolean_member (self, name, value):
+        self.members[name] = Node (bool (value))
+
+    def set_null_member (self, name):
+        self.members[name] = Node (None)
+
+    def set_array_member (self, name, value):
+        self.members[name] = Node (value)
+
+    def set_object_member (self, name, value):
+        self.members[name] = Node (value)
+
+    def remove_member (self, name):
+        del self.members[name]
+
+
+class Array ():
+    def __init__ (self, elements = None):
+        self.elements = elements if elements is not None else []
+
+    def copy (self):
+        return Array ([e.copy () for e in self.elements])
+
+    def get_elements (self):
+        return list (self.elements)
+
+    def get_length (self):
+        return len (self.elements)
+
+    def get_element (self, index):
+        return self.elements[index]
+
+    def remove_element (self, index):
+        del self.elements[index]
+
+    def add_element (self, node):
+        self.elements.append (node)
+
+    def add_string_element (self, value):
+        self.elements.append (Node (value))
+
+    def add_int_element (self, value):
+        self.elements.append (Node (value))
+
+    def add_object_element (self, value):
+        self.elements.append (Node (value))
+
+    def add_array_element (self, value):
+        self.elements.append (Node (value))
+
+
+class Parser ():
+    def __init__ (self):
+        self.root = None
+
+    def load_from_data (self, data, length = -1):
+        if length >= 0:
+            data = data[:length]
+        self.root = _to_node (json.loads (data, object_pairs_hook = _object_from_pairs))
+        return True
+
+    def load_from_file (self, filename):
+        f = open (filename)
+        try:
+            self.root = _to_node (json.load (f, object_pairs_hook = _object_from_pairs))
+        finally:
+            f.close ()
+        return True
+
+    def get_root (self):
+        return self.root
+
+
+class Builder ():
+    def __init__ (self):
+        self.root = None
+        # Stack of (container, pending member name)
+        self.stack = []
+
+    def _add (self, node):
+        if len (self.stack) == 0:
+            self.root = node
+            return
+
+        (container, name) = self.stack[-1]
+        if isinstance (container, Object):
+            container.set_member (name, node)
+            self.stack[-1] = (container, None)
+        else:
+            container.add_element (node)
+
+    def begin_object (self):
+        container = Object ()
+        self._add (Node (container))
+        self.stack.append ((container, None))
+        return self
+
+    def end_object (self):
+        self.stack.pop ()
+        return self
+
+    def begin_array (self):
+        container = Array ()
+        self._add (Node (container))
+        self.stack.append ((container, None))
+        return self
+
+    def end_array (self):
+        self.stack.pop ()
+        return self
+
+    def set_member_name (self, name):
+        (container, old_name) = self.stack[-1]
+        self.stack[-1] = (container, name)
+        return self
+
+    def add_value (self, node):
+        self._add (node)
+        return self
+
+    def add_string_value (self, value):
+        self._add (Node (value))
+        return self
+
+    def add_int_value (self, value):
+        self._add (Node (value))
+        return self
+
+    def add_boolean_value (self, value):
+        self._add (Node (bool (value)))
+        return self
+
+    def add_null_value (self):
+        self._add (Node (None))
+        return self
+
+    def get_root (self):
+        return self.root
@@ -0,0 +1,147 @@
+## Optional instrumentation: per-phase wall time and counters.
+##
+## Turn it on by setting TONY_STATS=1 in the environment (or calling
+## enable()); the summary is then written to stderr as a single JSON record
+## when the process exits, or to the file named by TONY_STATS_FILE. Setting
+## TONY_PROFILE_DIR as well writes a cProfile dump for each top-level phase
+## into that directory, as '<phase>.prof'.
+##
+## When disabled, phase() and count() do next to nothing.
+
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+enabled = False
+profile_dir = None
+
+_lock = threading.Lock ()
+_counters = {}
+_phases = {}
+_local = threading.local ()
+# Phases with a profile dump from this run
+_profiled = set ()
+
+
+class _NullPhase ():
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc_info):
+        return False
+
+_null_phase = _NullPhase ()
+
+
+class _Phase ():
+    def __init__ (self, name):
+        self.name = name
+        self.profiler = None
+
+    def __enter__ (self):
+        depth = getattr (_local, 'depth', 0)
+        _local.depth = depth + 1
+
+        # Only one profiler can be active at once, so nested phases are
+        # included in their parent's profile.
+        if profile_dir is not None and depth == 0:
+            self.profiler = cProfile.Profile ()
+            self.profiler.enable ()
+
+        self.start = time.time ()
+        return self
+
+    def __exit__ (self, *exc_info):
+        elapsed = time.time () - self.start
+        _local.depth -= 1
+
+        if self.profiler is not None:
+            self.profiler.disable ()
+            with _lock:
+                if not os.path.exists (profile_dir):
+                    os.makedirs (profile_dir)
+                # A phase that runs several times accumulates into one dump
+                filename = os.path.join (profile_dir, self.name + '.prof')
+                self.profiler.dump_stats (filename + '.tmp')
+                _merge_profile (filename, filename + '.tmp', self.name in _profiled)
+                _profiled.add (self.name)
+
+        with _lock:
+            phase = _phases.setdefault (self.name, { 'seconds': 0.0, 'calls': 0 })
+            phase['seconds'] += elapsed
+            phase['calls'] += 1
+        return False
+
+
+def _merge_profile (filename, new_filename, merge):
+    if merge:
+        stats = pstats.Stats (filename)
+        stats.add (new_filename)
+        stats.dump_stats (filename)
+        os.remove (new_filename)
+    else:
+        os.rename (new_filename, filename)
+
+def phase (name):
+    """
+    Context manager that records the wall time spent in phase 'name'.
+    """
+    if not enabled:
+        return _null_phase
+    return _Phase (name)
+
+def count (name, n = 1):
+    """
+    Add 'n' to counter 'name'.
+    """
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get (name, 0) + n
+
+def count_file_read (filename):
+    if not enabled:
+        return
+    count ('files-read')
+    try:
+        count ('bytes-read', os.path.getsize (filename))
+    except OSError:
+        pass
+
+def summary ():
+    with _lock:
+        return { 'phases': dict ((k, dict (v)) for (k, v) in _phases.items ()),
+                 'counters': dict (_counters) }
+
+def emit ():
+    record = summary ()
+    record['time'] = time.strftime ('%Y-%m-%dT%H:%M:%SZ', time.gmtime ())
+    record['argv'] = sys.argv
+
+    stats_file = os.environ.get ('TONY_STATS_FILE')
+    if stats_file:
+        f = open (stats_file, 'a')
+        json.dump (record, f, sort_keys = True)
+        f.write ('\n')
+        f.close ()
+    else:
+        json.dump (record, sys.stderr, sort_keys = True)
+        sys.stderr.write ('\n')
+
+def enable (profile_path = None):
+    global enabled, profile_dir
+
+    if profile_path is not None:
+        profile_dir = profile_path
+    if not enabled:
+        enabled = True
+        atexit.register (emit)
+
+
+if os.environ.get ('TONY_STATS', '') not in ['', '0']:
+    enable (os.environ.get ('TONY_PROFILE_DIR') or None)
@@ -0,0 +1,212 @@
+## Load stratum morphologies and work out which chunks are available to them
+## from the strata they build-depend on.
+##
+## Strata share most of their lower strata (devel, foundation, ...), so each
+## .morph is parsed only once per run and the set of chunks it provides is
+## computed once and handed out to every caller.
+##
+## Tools that only need the shape of a definitions directory (validate.py,
+## impact.py) read it with load_morphologies(), which summarises each .morph
+## with Python's json module instead of keeping a Json.Parser for it.
+
+import json
+import multiprocessing
+import os
+
+from tony_edit import ChunkIndex
+from tony_json import Json
+import tony_stats
+
+
+## Starting a process pool costs more than parsing a handful of files
+##
+MIN_FILES_FOR_POOL = 32
+
+
+def morph_filename(name):
+    if name.endswith('.morph'):
+        return name
+    return name + '.morph'
+
+
+def load_morphology(filename):
+    '''Returns tuple of (filename, error, summary), where 'summary' is a dict
+    with the 'kind' of morphology and, for strata, its 'build-depends' and its
+    list of (chunk name, build-depends) pairs as 'chunks', or for systems its
+    list of 'strata'.
+    '''
+    f = open(filename)
+    try:
+        data = json.load(f)
+    except ValueError as e:
+        return (filename, str(e), None)
+    finally:
+        f.close()
+
+    summary = {'kind': data.get('kind')}
+
+    # Older strata call them 'sources'
+    chunks = data.get('chunks', data.get('sources'))
+    if chunks is not None:
+        summary['kind'] = 'stratum'
+        summary['build-depends'] = [morph_filename(d['morph'])
+                                    for d in data.get('build-depends', [])]
+        summary['chunks'] = [(c['name'], c.get('build-depends', [])) for c in chunks]
+    elif 'strata' in data:
+        # Older systems list the strata by name only
+        summary['strata'] = [morph_filename(s if isinstance(s, basestring) else s['morph'])
+                             for s in data['strata']]
+
+    return (filename, None, summary)
+
+
+def load_morphologies(filenames, jobs=1):
+    '''load_morphology() for each of 'filenames', in 'jobs' processes if
+    there are enough of them to be worth it.
+    '''
+    if jobs > 1 and len(filenames) >= MIN_FILES_FOR_POOL:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            return pool.map(load_morphology, filenames)
+        finally:
+            pool.close()
+            pool.join()
+    return [load_morphology(f) for f in filenames]
+
+
+class StratumCycleError(Exception):
+    def __init__(self, filename):
+        self.filename = filename
+        Exception.__init__(self, "Stratum %s build-depends on itself" % filename)
+
+
+class StratumGraph():
+    def __init__(self):
+        # Absolute path -> (mtime, Json.Parser)
+        self.parsers = {}
+        # Absolute path -> ChunkIndex for the parsed stratum
+        self.chunk_indexes = {}
+        # Absolute path -> list of filenames of strata it build-depends on
+        self.build_depends = {}
+        # Absolute path -> frozenset of chunks defined in a stratum that was
+        # given to add_stratum(); parsed strata are read from their ChunkIndex
+        self.chunks = {}
+        # Absolute path -> frozenset of chunks available from lower strata
+        self.available_chunks = {}
+        self._loading = set()
+
+    def _key(self, filename):
+        return os.path.abspath(filename)
+
+    def get_parser(self, filename):
+        '''Returns Json.Parser for 'filename', parsing it only if it is not
+        already cached or has been modified since it was last parsed.
+        '''
+        key = self._key(filename)
+        mtime = os.stat(filename).st_mtime
+
+        cached = self.parsers.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        if cached is not None:
+            # A stratum changed underneath us, so any computed closure may be
+            # out of date.
+            self.chunk_indexes.pop(key, None)
+            self.build_depends = {}
+            self.chunks = {}
+            self.available_chunks = {}
+
+        parser = Json.Parser()
+        parser.load_from_file(filename)
+        tony_stats.count('strata-parsed')
+        tony_stats.count_file_read(filename)
+        self.parsers[key] = (mtime, parser)
+        return parser
+
+    def add_stratum(self, filename, build_depends, chunks):
+        '''Tell the graph about a stratum that has been read some other way,
+        so it never needs to parse 'filename' itself. Replaces anything
+        already known about 'filename'.
+        '''
+        key = self._key(filename)
+        chunks = frozenset(chunks)
+
+        if self.build_depends.get(key) != build_depends or \
+           self.chunks.get(key) != chunks:
+            self.available_chunks = {}
+
+        self.build_depends[key] = list(build_depends)
+        self.chunks[key] = chunks
+
+    def get_chunk_index(self, filename):
+        '''Returns the ChunkIndex for the stratum returned by get_parser()'''
+        key = self._key(filename)
+        parser = self.get_parser(filename)
+
+        index = self.chunk_indexes.get(key)
+        if index is None:
+            index = ChunkIndex(parser.get_root().get_object(),
+                               on_add=self._chunk_added)
+            self.chunk_indexes[key] = index
+        return index
+
+    def _chunk_added(self, name):
+        # Strata above the one that changed can now see one more chunk
+        self.available_chunks = {}
+
+    def get_build_depends(self, filename):
+        '''Returns list of filenames of the strata that 'filename' depends on'''
+        key = self._key(filename)
+
+        result = self.build_depends.get(key)
+        if result is not None:
+            return result
+
+        stratum = self.get_parser(filename).get_root().get_object()
+
+        result = []
+        build_dep_list = stratum.get_member('build-depends')
+        if build_dep_list is not None:
+            result = [node.get_object().get_member("morph").get_string()+".morph"
+                      for node in build_dep_list.get_array().get_elements()]
+
+        self.build_depends[key] = result
+        return result
+
+    def get_chunks(self, filename):
+        '''Returns frozenset of chunk names defined in stratum 'filename' '''
+        key = self._key(filename)
+
+        result = self.chunks.get(key)
+        if result is not None:
+            return result
+
+        # Not cached, so that chunks added through the index show up
+        return frozenset(self.get_chunk_index(filename).chunks)
+
+    def get_available_chunks(self, filename):
+        '''Returns frozenset of chunks from every stratum that 'filename'
+        depends on, directly or indirectly.
+        '''
+        key = self._key(filename)
+
+        result = self.available_chunks.get(key)
+        if result is not None:
+            return result
+
+        if key in self._loading:
+            raise StratumCycleError(filename)
+        self._loading.add(key)
+
+        try:
+            result = set()
+            for child_filename in self.get_build_depends(filename):
+                result.update(self.get_chunks(child_filename))
+                result.update(self.get_available_chunks(child_filename))
+        finally:
+            self._loading.discard(key)
+
+        result = frozenset(result)
+        self.available_chunks[key] = result
+        return result
@@ -1,31 +1,280 @@
 #!/usr/bin/python
 
+## Check the morphologies in the current directory for JSON errors and for
+## chunks with build-depends that can't be satisfied. A build-dep must be an
+## earlier chunk in the same stratum, or a chunk from one of the strata it
+## build-depends on (directly or indirectly).
+##
+## With --watch, keeps running and checks for changed files every --interval
+## seconds (by mtime), re-validating only the changed files and the strata
+## that depend on them.
+
+import argparse
 import glob
 import json
+import multiprocessing
+import os
+import sys
+import time
+
+from tony_stratum import StratumCycleError, StratumGraph, load_morphologies
+
+def load_strata (filenames, jobs):
+    """
+    Returns list of (filename, error, summary) from load_morphologies(), with
+    'summary' None for anything that isn't a stratum.
+    """
+    result = []
+    for (filename, error, summary) in load_morphologies (filenames, jobs):
+        if summary is not None and summary['kind'] != 'stratum':
+            # System, presumably
+            summary = None
+        result.append ((filename, error, summary))
+    return result
+
+def problem (filename, kind, message, chunk = None, build_dep = None):
+    return { 'file': filename, 'kind': kind, 'chunk': chunk,
+             'build-dep': build_dep, 'message': message }
 
-errors = False
+def validate_stratum (graph, filename, summary, missing_strata):
+    problems = []
+
+    for stratum in summary['build-depends']:
+        if stratum in missing_strata:
+            problems.append (problem (filename, 'unknown-stratum',
+                                      "%s: unknown build-depends stratum %s" % (filename, stratum)))
 
-for morphology in glob.glob('*.morph'):
-    f = open (morphology)
     try:
-        data = json.load (f)
-    except ValueError as e:
-        print "Error in %s: %s" % (morphology, e)
-        errors = True
-        continue
+        available = graph.get_available_chunks (filename)
+    except StratumCycleError as e:
+        # Every chunk would look unsatisfiable, which isn't the problem
+        if e.filename == filename:
+            message = "%s: build-depends on itself" % filename
+        else:
+            message = "%s: build-depends on %s, which build-depends on itself" % (filename, e.filename)
+        problems.append (problem (filename, 'stratum-cycle', message))
+        return problems
+
+    all_chunks = set (name for (name, build_depends) in summary['chunks'])
+    seen = set ()
+
+    for (name, build_depends) in summary['chunks']:
+        seen.add (name)
+
+        for build_dep in build_depends:
+            if build_dep in seen or build_dep in available:
+                continue
+
+            if build_dep in all_chunks:
+                problems.append (problem (filename, 'build-dep-order',
+                                          "%s: build-dep %s comes later in the stratum" % (name, build_dep),
+                                          name, build_dep))
+            else:
+                problems.append (problem (filename, 'unknown-build-dep',
+                                          "%s: unknown build-dep %s" % (name, build_dep),
+                                          name, build_dep))
+
+    return problems
+
+def add_to_graph (graph, loaded):
+    """
+    Tell 'graph' about every morphology in 'loaded', and about any stratum
+    that they build-depend on which doesn't exist, so the graph never has to
+    parse anything itself. Morphologies that failed to parse, or aren't
+    strata, provide no chunks. Returns the set of strata that don't exist.
+    """
+    strata = {}
+    missing_strata = set ()
+    for (filename, error, summary) in loaded:
+        if summary is not None:
+            strata[filename] = summary
+            graph.add_stratum (filename, summary['build-depends'],
+                               [name for (name, build_depends) in summary['chunks']])
+        else:
+            graph.add_stratum (filename, [], [])
+
+    for summary in strata.values ():
+        for stratum in summary['build-depends']:
+            if stratum not in strata and not os.path.exists (stratum):
+                graph.add_stratum (stratum, [], [])
+                missing_strata.add (stratum)
+
+    return missing_strata
+
+def validate (filenames, jobs = 1, graph = None):
+    """
+    Returns list of problems found in 'filenames', each a dict with 'file',
+    'kind', 'chunk', 'build-dep' and 'message' keys.
+    """
+    if graph is None:
+        graph = StratumGraph ()
+
+    loaded = load_strata (filenames, jobs)
+    missing_strata = add_to_graph (graph, loaded)
+
+    problems = []
+    for (filename, error, summary) in loaded:
+        if error is not None:
+            problems.append (problem (filename, 'parse-error',
+                                      "Error in %s: %s" % (filename, error)))
+        elif summary is not None:
+            problems.extend (validate_stratum (graph, filename, summary, missing_strata))
+
+    return problems
+
+class Watcher ():
+    """
+    Keeps every morphology's summary in memory, along with an index of which
+    strata build-depend on each stratum, and re-validates only what an edit
+    can have affected.
+    """
+
+    def __init__ (self, jobs = 1):
+        self.jobs = jobs
+        self.graph = StratumGraph ()
+        # Filename -> mtime when last loaded
+        self.mtimes = {}
+        # Filename -> (error, summary) as returned by load_strata()
+        self.loaded = {}
+        # Stratum filename -> set of filenames that build-depend on it
+        self.dependents = {}
+        # Filename -> list of problems from the last time it was validated
+        self.problems = {}
+
+    def _set_loaded (self, filename, error, summary):
+        old = self.loaded.get (filename, (None, None))[1]
+        if old is not None:
+            for stratum in old['build-depends']:
+                self.dependents[stratum].discard (filename)
+
+        if error is None and summary is None and not os.path.exists (filename):
+            # Deleted
+            self.loaded.pop (filename, None)
+            self.graph.add_stratum (filename, [], [])
+            return
+
+        self.loaded[filename] = (error, summary)
+        if summary is not None:
+            for stratum in summary['build-depends']:
+                self.dependents.setdefault (stratum, set ()).add (filename)
+            self.graph.add_stratum (filename, summary['build-depends'],
+                                    [name for (name, build_depends) in summary['chunks']])
+        else:
+            self.graph.add_stratum (filename, [], [])
+
+    def _affected (self, changed):
+        affected = set (changed)
+        queue = list (changed)
+        while queue:
+            for dependent in self.dependents.get (queue.pop (), ()):
+                if dependent not in affected:
+                    affected.add (dependent)
+                    queue.append (dependent)
+        return affected
+
+    def scan (self):
+        """
+        Returns the filenames that were added, modified or deleted since the
+        last scan.
+        """
+        mtimes = {}
+        for filename in glob.glob ('*.morph'):
+            try:
+                mtimes[filename] = os.stat (filename).st_mtime
+            except OSError:
+                pass
+
+        changed = [f for f in mtimes if self.mtimes.get (f) != mtimes[f]]
+        changed += [f for f in self.mtimes if f not in mtimes]
+        self.mtimes = mtimes
+        return sorted (changed)
+
+    def update (self, changed):
+        """
+        Reload 'changed' and re-validate them and every stratum that depends
+        on them. Returns the list of filenames that were re-validated.
+        """
+        existing = [f for f in changed if os.path.exists (f)]
+        for (filename, error, summary) in load_strata (existing, self.jobs):
+            self._set_loaded (filename, error, summary)
+        for filename in changed:
+            if filename not in existing:
+                self._set_loaded (filename, None, None)
+                self.problems.pop (filename, None)
+
+        affected = sorted (f for f in self._affected (changed) if f in self.loaded)
+        for filename in affected:
+            (error, summary) = self.loaded[filename]
+            if error is not None:
+                self.problems[filename] = [problem (filename, 'parse-error',
+                                                    "Error in %s: %s" % (filename, error))]
+            elif summary is not None:
+                missing_strata = set (s for s in summary['build-depends']
+                                      if s not in self.loaded and not os.path.exists (s))
+                for stratum in missing_strata:
+                    self.graph.add_stratum (stratum, [], [])
+                self.problems[filename] = validate_stratum (self.graph, filename, summary,
+                                                            missing_strata)
+            else:
+                self.problems[filename] = []
+
+        return affected
+
+    def all_problems (self):
+        return [p for f in sorted (self.problems) for p in self.problems[f]]
+
+    def watch (self, as_json, interval = 0.5):
+        while True:
+            changed = self.scan ()
+            if changed:
+                affected = self.update (changed)
+                problems = [p for f in affected for p in self.problems[f]]
+                if as_json:
+                    json.dump ({ 'changed': changed, 'validated': affected,
+                                 'problems': problems,
+                                 'total-problems': len (self.all_problems ()) },
+                               sys.stdout)
+                    sys.stdout.write ('\n')
+                else:
+                    report (problems, False)
+                    print "-- validated %i file(s), %i problem(s) in total" % \
+                        (len (affected), len (self.all_problems ()))
+                sys.stdout.flush ()
+            time.sleep (interval)
+
+def report (problems, as_json):
+    if as_json:
+        json.dump ({ 'errors': len (problems) > 0, 'problems': problems },
+                   sys.stdout, indent = 4)
+        sys.stdout.write ('\n')
+    else:
+        for p in problems:
+            print p['message']
 
-    chunk_list = []
+def main ():
+    parser = argparse.ArgumentParser (description = "Validate morphologies")
+    parser.add_argument ('--json', action = 'store_true',
+                         help = "write a machine-readable report to stdout")
+    parser.add_argument ('--jobs', '-j', type = int,
+                         default = multiprocessing.cpu_count (),
+                         help = "number of processes used to parse morphologies")
+    parser.add_argument ('--watch', action = 'store_true',
+                         help = "keep running and re-validate whatever each edit affects")
+    parser.add_argument ('--interval', type = float, default = 0.5,
+                         help = "seconds between checks for changes in --watch mode")
+    args = parser.parse_args ()
 
-    if 'sources' not in data:
-        # System, presumably
-        continue
+    if args.watch:
+        try:
+            Watcher (args.jobs).watch (args.json, args.interval)
+        except KeyboardInterrupt:
+            pass
+        return
 
-    for chunk in data['sources']:
-        chunk_list.append (chunk['name'])
+    problems = validate (sorted (glob.glob ('*.morph')), args.jobs)
+    report (problems, args.json)
 
-        for build_dep in chunk['build-depends']:
-            if build_dep not in chunk_list:
-                errors = True
-                print "%s: unknown build-dep %s" % (chunk['name'], build_dep)
+    exit (len (problems) > 0)
 
-exit (errors)
+if __name__ == '__main__':
+    main ()